@@ -33,7 +33,7 @@ function bandwidthGraph($scope, $modal, bandwidthWebsocket) {
         }
 
         // Push single or several entries according to type of reply
-        if(res.header == 'BW-CACHE') {
+        if(res.header == 'BW-CACHE' || res.header == 'BW-RANGE') {
             for(i in res.entries) {
                 read_bytes.unshift(res.entries[i].read);
                 written_bytes.unshift(res.entries[i].written);
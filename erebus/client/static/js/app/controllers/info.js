@@ -28,13 +28,55 @@ function relayInfo($scope, infoWebsocket) {
             res = {'version': 'Unknown', 'nickname': 'Unnamed', 'fingerprint': '-'};
         }
         $scope.$apply(function () {
-            $scope.info = res;
+            if (res.header === 'RELAY-STATUS') {
+                $scope.relay = relayStatus(res);
+            } else {
+                $scope.info = res;
+                if (res.status === 'offline') {
+                    $scope.relay = {};
+                }
+            }
         });
     });
 
     function activate() {
         $scope.info = [];
-        // Request relay info
+        $scope.relay = {};
+        // Request relay info and status
         infoWebsocket.getInfo();
+        infoWebsocket.getRelayStatus();
     }
 }
+
+// Readable values of a RELAY-STATUS message
+function relayStatus(res) {
+    var relay = {
+        'flags': (res.flags || []).join(', '),
+        'family': (res.family || []).join(', '),
+        'exitPolicy': res.exit_policy,
+    };
+
+    if (res.consensus_weight !== undefined) {
+        relay.weight = res.consensus_weight + (res.unmeasured ? ' (unmeasured)' : '');
+    }
+    if (res.advertised !== undefined) {
+        relay.advertised = formatBytesPerSec(res.advertised, 2);
+        relay.observed = formatBytesPerSec(res.observed, 2);
+    }
+    if (res.uptime !== undefined) {
+        // Uptime is as of when our descriptor was published
+        var now = Math.floor(Date.now() / 1000);
+        relay.uptime = formatUptime(res.uptime + Math.max(0, now - res.published));
+    }
+    return relay;
+}
+
+function formatUptime(seconds) {
+    var days = Math.floor(seconds / 86400);
+    var hours = Math.floor((seconds % 86400) / 3600);
+    var minutes = Math.floor((seconds % 3600) / 60);
+
+    if (days > 0) return days + 'd ' + hours + 'h';
+    if (hours > 0) return hours + 'h ' + minutes + 'm';
+    return minutes + 'm';
+}
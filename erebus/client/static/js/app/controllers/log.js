@@ -17,7 +17,9 @@ angular
 logConsole.$inject = ['$scope', '$modal', 'logWebsocket', 'logEntry', 'logGroup'];
     
 function logConsole($scope, $modal, logWebsocket, logEntry, logGroup) {
-    var entries = new logGroup();
+    var entries = new logGroup(),
+        pageSize = entries.maxSize,
+        loadingPage = false;
 
     activate();
 
@@ -29,11 +31,17 @@ function logConsole($scope, $modal, logWebsocket, logEntry, logGroup) {
         if(entry.isValid()) {
             $scope.$apply(function () {
                 // Push single or several entries according to entry header
-                if(entry.getHeader() == 'LOG-CACHE') {
+                if(entry.getHeader() == 'LOG-CACHE' || entry.getHeader() == 'LOG-BATCH') {
                     local_entries = entry.getEntries();
                     for(i in local_entries) {
-                        entries.add(local_entries[i]);
+                        entries.add(new logEntry(angular.extend({header: 'LOG-ENTRY'}, local_entries[i])));
                     }
+                } else if(entry.getHeader() == 'LOG-PAGE') {
+                    addPage(entry);
+                } else if(entry.getHeader() == 'LOG-REPEAT') {
+                    entries.repeat(entry.getRepeats());
+                } else if(entry.getHeader() == 'LOG-SUMMARY') {
+                    addSummaries(entry);
                 } else {
                     entries.add(entry);
                 }
@@ -42,16 +50,51 @@ function logConsole($scope, $modal, logWebsocket, logEntry, logGroup) {
         }
     });
     
-    $scope.duplicates = function() {
-        $scope.hideDuplicates = !$scope.hideDuplicates; // Switch boolean value
-        if($scope.hideDuplicates) {
-            entries.hideDuplicates();
+    // Request the page of entries older than the ones we have
+    $scope.loadOlder = function() {
+        if($scope.nextCursor && !loadingPage) {
+            loadingPage = true;
+            logWebsocket.getPage($scope.nextCursor, pageSize);
+        }
+    }
+
+    // Pages come newest first. The first one is the newest entries, and
+    // the rest are older than what we have.
+    function addPage(page) {
+        var i, local_entries = page.getEntries();
+
+        if(page.getEntry().cursor) {
+            for(i = 0; i < local_entries.length; i++) {
+                entries.addOlder(new logEntry(angular.extend({header: 'LOG-ENTRY'}, local_entries[i])));
+            }
         } else {
-            entries.showDuplicates();
+            for(i = local_entries.length - 1; i >= 0; i--) {
+                entries.add(new logEntry(angular.extend({header: 'LOG-ENTRY'}, local_entries[i])));
+            }
         }
-        $scope.entries = entries.getAll();
+        $scope.nextCursor = page.getEntry().next;
+        loadingPage = false;
     }
-    
+
+    // Events over their rate limit are summarized by the server, and shown
+    // as a single entry for each type
+    function addSummaries(summary) {
+        var i, j, top, summaries = summary.getSummaries();
+
+        for(i in summaries) {
+            top = [];
+            for(j in summaries[i].top) {
+                top.push(summaries[i].top[j].message + ' (' + summaries[i].top[j].count + ')');
+            }
+            entries.add(new logEntry({
+                header: 'LOG-ENTRY',
+                time: summary.getEntry().time,
+                type: summaries[i].type,
+                message: summaries[i].count + ' events over the rate limit, most common: ' + top.join(', ')
+            }));
+        }
+    }
+
     // Open modal box to change event filters
     $scope.eventFiltering = function() {
         // Angular UI modal (for bootstrap)
@@ -76,9 +119,9 @@ function logConsole($scope, $modal, logWebsocket, logEntry, logGroup) {
 
     function activate() {
         $scope.entries = [];
-        $scope.hideDuplicates = true;
-        // Request log cache
-        logWebsocket.getCache();
+        $scope.nextCursor = null;
+        // Request the newest entries, older ones are loaded on demand
+        logWebsocket.getPage(null, pageSize);
     }
 }
 
@@ -14,31 +14,19 @@ angular
     .module('erebus')
     .factory('bandwidthWebsocket', bandwidthWebsocket);
 
-bandwidthWebsocket.$inject = ['$websocket', 'CONFIG'];
-    
-function bandwidthWebsocket($websocket, CONFIG) {
-    var ws = $websocket(CONFIG.server_address + CONFIG.ws.bandwidth);
+bandwidthWebsocket.$inject = ['streamWebsocket'];
+
+function bandwidthWebsocket(streamWebsocket) {
+    var ws = streamWebsocket.channel('bandwidth');
     return {
         start: function(callback) {
-            ws.onMessage(function(event) {
-                /*console.log('bw event: ', event);*/
-                callback(event);
-            });
-
-            ws.onError(function(event) {
-                console.log('connection error', event);
-            });
-
-            ws.onClose(function(event) {
-                console.log('connection closed', event);
-            });
-
-            ws.onOpen(function() {
-                console.log('connection open');
-            });
+            ws.start(callback);
         },
         getCache: function() {
-            ws.send(JSON.stringify({ request: 'BW-CACHE' }));
+            ws.send({ request: 'BW-CACHE' });
+        },
+        getRange: function(from, to, points) {
+            ws.send({ request: 'BW-RANGE', from: from, to: to, points: points });
         },
     }
 }
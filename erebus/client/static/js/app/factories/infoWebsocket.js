@@ -14,30 +14,19 @@ angular
     .module('erebus')
     .factory('infoWebsocket', infoWebsocket);
 
-infoWebsocket.$inject = ['$websocket', 'CONFIG'];
-    
-function infoWebsocket($websocket, CONFIG) {
-    var ws = $websocket(CONFIG.server_address + CONFIG.ws.info);
+infoWebsocket.$inject = ['streamWebsocket'];
+
+function infoWebsocket(streamWebsocket) {
+    var ws = streamWebsocket.channel('info');
     return {
         start: function(callback) {
-            ws.onMessage(function(event) {
-                callback(event);
-            });
-
-            ws.onError(function(event) {
-                console.log('connection error', event);
-            });
-
-            ws.onClose(function(event) {
-                console.log('connection closed', event);
-            });
-
-            ws.onOpen(function() {
-                console.log('connection open');
-            });
+            ws.start(callback);
         },
         getInfo: function() {
-            ws.send(JSON.stringify({ request: 'INFO' }));
+            ws.send({ request: 'INFO' });
+        },
+        getRelayStatus: function() {
+            ws.send({ request: 'RELAY-STATUS' });
         },
     }
 }
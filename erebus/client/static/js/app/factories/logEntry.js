@@ -22,12 +22,20 @@ function logEntry(CONFIG) {
         this.entry = {};
         this.count = 0;
         this.validEntry = false;
-        this.duplicates = [];
 
         try {
-            this.entry = JSON.parse(data);
+            // Entries of LOG-CACHE and LOG-BATCH messages are already parsed
+            this.entry = (typeof data === 'string') ? JSON.parse(data) : data;
             if(("header" in this.entry) && ("time" in this.entry) && ("message" in this.entry) && ("type" in this.entry)) {
                 this.validEntry = true;
+                // Number of times the server has seen this entry, if repeated
+                this.count = this.entry.count || 0;
+            } else if(("header" in this.entry) && ("entries" in this.entry)) {
+                this.validEntry = true;
+            } else if(("header" in this.entry) && ("repeats" in this.entry)) {
+                this.validEntry = true;
+            } else if(("header" in this.entry) && ("summaries" in this.entry)) {
+                this.validEntry = true;
             }
         } catch(e) {
             console.log('Received bad log entry');
@@ -54,41 +62,20 @@ function logEntry(CONFIG) {
         return this.entry.readable_time;
     };
         
-    logEntry.prototype.addDuplicate = function(entry) {
-        this.duplicates.push(entry);
-        // Check if it's the first duplicate
-        if(this.count == 0) {
-            this.count = 2;
-        } else {
-            this.count += 1;
-        }
+    logEntry.prototype.getId = function() {
+        return this.entry.id;
     };
-        
+
+    // The server counts repeats of an entry rather than sending them again
+    logEntry.prototype.setCount = function(count, time) {
+        this.count = count;
+        this.entry.time = time;
+    };
+
     logEntry.prototype.numDuplicates = function() {
         return this.count;
     };
-    
-    logEntry.prototype.getDuplicates = function() {
-        return this.duplicates;
-    };
-    
-    logEntry.prototype.popDuplicates = function() {
-        var entries;
-        if(this.count > 0) {
-            entries = this.duplicates;
-            this.count = 0;
-            this.duplicates = [];
-        }
-        return entries;
-    };
-        
-    logEntry.prototype.removeDuplicate = function() {
-        if(this.count > 0) {
-            this.duplicates.pop();
-            this.count -= 1;
-        }
-    };
-        
+
     logEntry.prototype.getEntry = function() {
         return this.entry;
     };
@@ -100,67 +87,22 @@ function logEntry(CONFIG) {
             return {};
         }
     };
-        
-    logEntry.prototype.isDuplicateOf = function(entry) {
-        var i, entryMsg, selfMsg, commonMsgs;
-        if(this.getType() != entry.getType()) {
-            return false;
-        } else if(this.getMessage() == entry.getMessage()) {
-            return true;
+
+    logEntry.prototype.getSummaries = function() {
+        if("summaries" in this.entry) {
+            return this.entry.summaries;
+        } else {
+            return [];
         }
-        
-        entryMsg = entry.getMessage();
-        selfMsg = this.getMessage();
-        commonMsgs = commonLogMessages(this.getType());
-        for(i in commonMsgs) {
-            if(selfMsg.indexOf(commonMsgs[i]) > -1 && entryMsg.indexOf(commonMsgs[i]) > -1) {
-                return true;
-            }
+    };
+
+    logEntry.prototype.getRepeats = function() {
+        if("repeats" in this.entry) {
+            return this.entry.repeats;
+        } else {
+            return [];
         }
-        return false;
     };
     
     return logEntry;
 }
-
-function commonLogMessages(type) {
-    var messages = {
-        'debug': [
-            "connection_handle_write(): After TLS write of",
-            "flush_chunk_tls(): flushed",
-            "conn_read_callback(): socket",
-            "conn_write_callback(): socket",
-            "connection_remove(): removing socket",
-            "connection_or_process_cells_from_inbuf():",
-            "pending in tls object). at_most", //*
-            "connection_read_to_buf(): TLS connection closed on read. Closing.",
-        ],
-        'info': [
-            "run_connection_housekeeping(): Expiring",
-            "rep_hist_downrate_old_runs(): Discounting all old stability info by a factor of",
-            "build time we have ever observed. Capping it to", //*
-        ],
-        'notice': [
-            "build time we have ever observed. Capping it to", //*
-            "We will now assume a circuit is too slow to use after waiting", //*
-            "We stalled too much while trying to write",
-            "I learned some more directory information, but not enough to build a circuit",
-            "Attempt by",
-            "Loading relay descriptors.", //*
-            "Average packaged cell fullness:",
-            "Heartbeat: Tor's uptime is",
-        ],
-        'warn': [
-            "You specified a server",
-            "I have no descriptor for the router named",
-            "Controller gave us config lines that didn't validate",
-            "Problem bootstrapping. Stuck at",
-            "missing key,", //*
-        ]
-    }
-    if(type in messages) {
-        return messages[type];
-    } else {
-        return [];
-    }
-}
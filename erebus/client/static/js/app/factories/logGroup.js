@@ -19,47 +19,61 @@ logGroup.$inject = ['CONFIG'];
 function logGroup(CONFIG) {
 
     var logGroup = function() {
-        this.groupDuplicates = true;
         this.maxSize = 10; // CONFIG.max_log_size
-        this.entries = []
-        this.groupSize = 0;
+        this.entries = [];
+        // Entries by their server side id. The server collapses repeated
+        // entries, and sends their counts in LOG-REPEAT messages.
+        this.entriesById = {};
     };
 
     logGroup.prototype.add = function(entry) {
-        var i, duplicate = -1;
+        var id = entry.getId();
 
-        if(this.groupDuplicates) {
-            // Look for duplicates in existing entries
-            for(i in this.entries) {
-                if(entry.isDuplicateOf(this.entries[i])) {
-                    duplicate = i;
-                    break;
-                }
-            }
-            if(duplicate != -1) {
-                // Found duplicate
-                this.entries[duplicate].addDuplicate(entry);
-            } else {
-                this.entries.unshift(entry);
-                this.groupSize += 1;
+        if(id !== undefined) {
+            // Skip entries we already have (say, from both the log cache
+            // and live events)
+            if(id in this.entriesById) {
+                return;
             }
-        } else {
-            this.entries.unshift(entry);
-            this.groupSize += 1;
+            this.entriesById[id] = entry;
         }
-            
-        while(this.groupSize > this.maxSize) {
+        this.entries.unshift(entry);
+
+        while(this.entries.length > this.maxSize) {
             this.pop();
         }
     };
         
+    // Add an older entry (from a LOG-PAGE) at the bottom. The group grows
+    // to hold it, since it was asked for.
+    logGroup.prototype.addOlder = function(entry) {
+        var id = entry.getId();
+
+        if(id !== undefined) {
+            if(id in this.entriesById) {
+                return;
+            }
+            this.entriesById[id] = entry;
+        }
+        this.entries.push(entry);
+        this.maxSize = Math.max(this.maxSize, this.entries.length);
+    };
+
     logGroup.prototype.pop = function() {
-        var lastEntry = this.entries[this.groupSize-1];
-        if(lastEntry.numDuplicates() == 0) {
-            this.entries.pop();
-            this.groupSize -= 1;
-        } else {
-            lastEntry.removeDuplicate();
+        var lastEntry = this.entries.pop();
+        if(lastEntry !== undefined) {
+            delete this.entriesById[lastEntry.getId()];
+        }
+    };
+
+    // Update the counts of repeated entries, from a LOG-REPEAT message
+    logGroup.prototype.repeat = function(repeats) {
+        var i, entry;
+        for(i in repeats) {
+            entry = this.entriesById[repeats[i].id];
+            if(entry !== undefined) {
+                entry.setCount(repeats[i].count, repeats[i].time);
+            }
         }
     };
 
@@ -77,49 +91,7 @@ function logGroup(CONFIG) {
     
     logGroup.prototype.emptyLog = function() {
         this.entries = [];
-        this.groupSize = 0;
-    };
-    
-    logGroup.prototype.showDuplicates = function() {
-        var i, j, entry, dedup_entries = [], dup_entries = [];
-        
-        this.groupDuplicates = false;
-        // Get all entries and their duplicates
-        for(i in this.entries) {
-            entry = this.entries[i];
-            // Push duplicates
-            if(entry.numDuplicates() > 0) {
-                dedup_entries = entry.popDuplicates();
-                for(j in dedup_entries) {
-                    dup_entries.push(dedup_entries[j]);
-                }
-            }
-            // Push original entry to deduplicated list
-            dup_entries.push(entry);
-        }
-        // Drop all log entries
-        this.emptyLog();
-        // Refill
-        for(i in dup_entries) {
-            this.add(dup_entries[i]);
-        }
-    };
-    
-    // Hide duplicates
-    logGroup.prototype.hideDuplicates = function() {
-        var i, dup_entries = [];
-        
-        this.groupDuplicates = true;
-        
-        for(i in this.entries) {
-            dup_entries.push(this.entries[i]);
-        }
-        // Drop all log entries
-        this.emptyLog();
-        // Refill
-        for(i in dup_entries) {
-            this.add(dup_entries[i]);
-        }
+        this.entriesById = {};
     };
     
     return logGroup;
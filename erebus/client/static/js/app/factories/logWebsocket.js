@@ -14,31 +14,21 @@ angular
     .module('erebus')
     .factory('logWebsocket', logWebsocket);
 
-logWebsocket.$inject = ['$websocket', 'CONFIG'];
-    
-function logWebsocket($websocket, CONFIG) {
-    var ws = $websocket(CONFIG.server_address + CONFIG.ws.log);
+logWebsocket.$inject = ['streamWebsocket'];
+
+function logWebsocket(streamWebsocket) {
+    var ws = streamWebsocket.channel('log');
     return {
         start: function(callback) {
-            ws.onMessage(function(event) {
-                /*console.log('log entry: ', event);*/
-                callback(event);
-            });
-
-            ws.onError(function(event) {
-                console.log('connection error', event);
-            });
-
-            ws.onClose(function(event) {
-                console.log('connection closed', event);
-            });
-
-            ws.onOpen(function() {
-                console.log('connection open');
-            });
+            ws.start(callback);
         },
         getCache: function() {
-            ws.send(JSON.stringify({ request: 'LOG-CACHE' }));
+            ws.send({ request: 'LOG-CACHE' });
+        },
+        // Newest entries if no cursor is given, otherwise the ones older
+        // than the cursor of a previous page
+        getPage: function(cursor, size, types) {
+            ws.send({ request: 'LOG-PAGE', cursor: cursor, size: size, types: types });
         },
     }
 }
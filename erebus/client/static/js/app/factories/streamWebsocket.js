@@ -0,0 +1,68 @@
+/*
+* This file is part of Erebus, a web dashboard for tor relays.
+*
+* :copyright:   (c) 2015, The Tor Project, Inc.
+*               (c) 2015, Damian Johnson
+*               (c) 2015, Cristobal Leiva
+*
+* :license: See LICENSE for licensing information.
+*/
+
+'use strict';
+
+angular
+    .module('erebus')
+    .factory('streamWebsocket', streamWebsocket);
+
+streamWebsocket.$inject = ['$websocket', 'CONFIG'];
+
+// Single websocket carrying every channel (bandwidth, log, info). Messages
+// are tagged with their channel and dispatched to the channel's callback.
+function streamWebsocket($websocket, CONFIG) {
+    var ws = $websocket(CONFIG.server_address + CONFIG.ws.stream);
+    var callbacks = {};
+
+    ws.onMessage(function(event) {
+        var res;
+        try {
+            res = JSON.parse(event.data);
+        } catch(e) {
+            console.log('Received bad stream message');
+            return;
+        }
+        if(res.channel in callbacks) {
+            callbacks[res.channel](event);
+        }
+    });
+
+    ws.onError(function(event) {
+        console.log('connection error', event);
+    });
+
+    ws.onClose(function(event) {
+        console.log('connection closed', event);
+    });
+
+    ws.onOpen(function() {
+        console.log('connection open');
+    });
+
+    return {
+        channel: function(name) {
+            return {
+                start: function(callback) {
+                    callbacks[name] = callback;
+                    ws.send(JSON.stringify({ request: 'SUBSCRIBE', channel: name }));
+                },
+                stop: function() {
+                    delete callbacks[name];
+                    ws.send(JSON.stringify({ request: 'UNSUBSCRIBE', channel: name }));
+                },
+                send: function(request) {
+                    request.channel = name;
+                    ws.send(JSON.stringify(request));
+                },
+            }
+        },
+    }
+}
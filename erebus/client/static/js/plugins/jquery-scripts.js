@@ -11,4 +11,10 @@ jQuery(document).ready(function() {
         disableFadeOut: false,
         start: 'bottom',
     });
+    // Older log entries are loaded when scrolling to the bottom
+    jQuery("#log-console").bind('slimscroll', function(e, pos) {
+        if(pos == 'bottom') {
+            angular.element(this).scope().$apply('loadOlder()');
+        }
+    });
 });
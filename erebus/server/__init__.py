@@ -15,19 +15,30 @@ Define handlers and settings for the server app.
 
 import stem.util.enum
 
-from erebus.server import websockets
+from erebus.server import api, websockets
 
 ServerHandlers = stem.util.enum.Enum(
     ('BANDWIDTH', r"/bandwidth"),
     ('LOG', r"/log"),
     ('INFO', r"/info"),
+    ('STREAM', r"/stream"),
 )
 
-# List of server routes and their handlers (websockets)
+ApiHandlers = stem.util.enum.Enum(
+    ('STATS', r"/api/stats"),
+    ('BANDWIDTH', r"/api/bandwidth"),
+    ('LOG_SEARCH', r"/api/log/search"),
+)
+
+# List of server routes and their handlers (websockets and HTTP endpoints)
 SERVER_HANDLERS = [
     (ServerHandlers.BANDWIDTH, websockets.BandwidthWSHandler),
     (ServerHandlers.LOG, websockets.LogWSHandler),
     (ServerHandlers.INFO, websockets.InfoWSHandler),
+    (ServerHandlers.STREAM, websockets.StreamWSHandler),
+    (ApiHandlers.STATS, api.StatsHandler),
+    (ApiHandlers.BANDWIDTH, api.BandwidthRangeHandler),
+    (ApiHandlers.LOG_SEARCH, api.LogSearchHandler),
 ]
 
 # No special settings for the server (for now).
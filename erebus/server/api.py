@@ -0,0 +1,112 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+HTTP endpoints of the server app. Unlike websockets, these are plain
+request/response handlers that reply with JSON.
+"""
+
+import cyclone.web
+
+from erebus.server import websockets
+from erebus.server.handlers import archive, graph, history, info, log
+from erebus.util import executor
+from erebus.util.executor import run_query
+
+
+class StatsHandler(cyclone.web.RequestHandler):
+    """
+    Provides statistics of the websocket controller and our caches.
+    """
+
+    def get(self):
+        """
+        This method will be called when a HTTP GET request is made
+        to the StatsHandler.
+        """
+
+        output = {}
+
+        ws = websockets.ws_controller()
+        if ws is not None:
+            output['websockets'] = ws.stats()
+
+        bw = graph.bw_handler()
+        if bw is not None:
+            output['bandwidth'] = bw.stats()
+
+        if info.RELAY_INFO is not None:
+            output['relay_info'] = info.RELAY_INFO.stats()
+
+        log_archive = archive.log_archive()
+        if log_archive is not None:
+            output['log_archive'] = log_archive.stats()
+
+        query_executor = executor.query_executor()
+        if query_executor is not None:
+            output['queries'] = query_executor.stats()
+
+        self.write(output)
+
+
+class BandwidthRangeHandler(cyclone.web.RequestHandler):
+    """
+    Provides the bandwidth history within a time range, downsampled to at
+    most the requested number of points (same as the BW-RANGE request).
+    """
+
+    def get(self):
+        """
+        This method will be called when a HTTP GET request is made
+        to the BandwidthRangeHandler. Accepted arguments are 'from' and
+        'to' (unix timestamps) and 'points'.
+        """
+
+        try:
+            start = int(self.get_argument('from'))
+            end = self.get_argument('to', None)
+            points = int(self.get_argument('points', 0))
+            end = int(end) if end is not None else None
+        except ValueError as exc:
+            raise cyclone.web.HTTPError(400, str(exc))
+
+        self.write(history.get_range(start, end, points))
+
+
+class LogSearchHandler(cyclone.web.RequestHandler):
+    """
+    Provides the newest log entries matching a query (same as the LOG-SEARCH
+    request).
+    """
+
+    def get(self):
+        """
+        This method will be called when a HTTP GET request is made
+        to the LogSearchHandler. Accepted arguments are 'q' (words and
+        quoted phrases), 'from' and 'to' (unix timestamps), 'type' (which
+        can be repeated) and 'limit'.
+        """
+
+        try:
+            start = self.get_argument('from', None)
+            end = self.get_argument('to', None)
+            limit = int(self.get_argument('limit', 0))
+            start = int(start) if start is not None else None
+            end = int(end) if end is not None else None
+        except ValueError as exc:
+            raise cyclone.web.HTTPError(400, str(exc))
+
+        # Searching reads the archive, so it's kept off the reactor.
+        d = run_query(
+            log.search_logs, self.get_argument('q', ''), start, end,
+            self.get_arguments('type'), limit)
+        d.addCallback(self.write)
+        return d
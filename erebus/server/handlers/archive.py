@@ -0,0 +1,836 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Persistent archive of tor and erebus log entries. Entries are appended to
+segment files in zlib compressed blocks, and the oldest segments are removed
+once the archive exceeds its size or age limit.
+
+Each block's header has the time range of its entries, and we keep these in
+memory as a sparse index of each segment. Reading a time range only
+decompresses the blocks overlapping it.
+
+Blocks are compressed and written by a thread, so the reactor never waits
+on the disk. If a write fails its entries are dropped, and we don't try
+again for `log.archive.sync` seconds.
+
+Blocks are also indexed for full-text search (see
+:mod:`~erebus.server.handlers.search`). The tokens of each block are kept in
+a file alongside its segment, so the index can be rebuilt without reading
+the blocks.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+from stem.util import conf, log
+from twisted.internet import defer, reactor, task, threads
+
+from erebus.server.handlers.search import LogIndex, index_tokens, matches, \
+    query_words
+from erebus.util import msg
+
+
+def conf_handler(key, value):
+    if key in ('log.archive.blockSize', 'log.archive.segmentSize',
+               'log.archive.segmentAge', 'log.archive.sync'):
+        return max(1, value)
+    elif key in ('log.archive.maxSize', 'log.archive.maxAge'):
+        return max(0, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'log.archive.path': '~/.erebus/logs',
+    'log.archive.blockSize': 65536,
+    'log.archive.segmentSize': 4194304,
+    'log.archive.segmentAge': 86400,
+    'log.archive.maxSize': 104857600,
+    'log.archive.maxAge': 2592000,
+    'log.archive.sync': 60,
+}, conf_handler)
+
+LOG_ARCHIVE = None
+
+# Header of each block: magic, time range of its entries (oldest and newest
+# timestamps), number of entries, length of the compressed entries that
+# follow and their checksum.
+BLOCK = struct.Struct('<4sddIII')
+BLOCK_MAGIC = b'ELOG'
+
+# Each entry is its timestamp and the lengths of its type and message,
+# followed by both of them (utf-8 encoded).
+ENTRY = struct.Struct('<dHI')
+
+# Each record of a segment's tokens file is the offset of the block it's
+# for, the length of the zlib compressed tokens that follow and their
+# checksum.
+TOKENS = struct.Struct('<QII')
+
+SEGMENT_SUFFIX = '.seg'
+TOKENS_SUFFIX = '.idx'
+
+
+def log_archive():
+    """
+    Provides the LOG_ARCHIVE singleton.
+
+    :returns: :class:`~erebus.server.handlers.archive.LogArchive`, or
+      **None** if we aren't archiving logs
+    """
+
+    return LOG_ARCHIVE
+
+
+def init_log_archive():
+    """
+    Initializes the log archive instance, if `log.archive.path` is set.
+    """
+
+    global LOG_ARCHIVE
+    path = CONFIG['log.archive.path']
+
+    if path:
+        path = os.path.expanduser(path)
+        try:
+            LOG_ARCHIVE = LogArchive(path)
+        except (IOError, OSError) as exc:
+            log.notice(msg('log.archive_unavailable', path=path, error=exc))
+
+
+def _encode(value):
+    return value.encode('utf-8') if isinstance(value, type(u'')) else value
+
+
+def encode_entries(entries):
+    """
+    Serializes log entries for a block.
+
+    :param list entries: **list** of (timestamp, type, message) tuples.
+
+    :returns: **bytes** with the uncompressed content of the block
+    """
+
+    content = []
+
+    for timestamp, event_type, message in entries:
+        event_type, message = _encode(event_type), _encode(message)
+        content.append(ENTRY.pack(timestamp, len(event_type), len(message)))
+        content.append(event_type)
+        content.append(message)
+
+    return b''.join(content)
+
+
+def decode_entries(content, accept=None):
+    """
+    Deserializes the log entries of a block.
+
+    :param bytes content: uncompressed content of the block.
+    :param func accept: check of each entry's encoded message, entries it
+      rejects are skipped without decoding them.
+
+    :returns: **list** of (timestamp, type, message) tuples
+    """
+
+    entries, types, position = [], {}, 0
+
+    while position < len(content):
+        timestamp, type_len, message_len = \
+            ENTRY.unpack_from(content, position)
+        position += ENTRY.size
+
+        event_type = content[position:position + type_len]
+        position += type_len
+        message = content[position:position + message_len]
+        position += message_len
+
+        if accept is not None and not accept(message):
+            continue
+
+        # There's only a handful of types, so each is only decoded once.
+        decoded_type = types.get(event_type)
+        if decoded_type is None:
+            decoded_type = types[event_type] = \
+                event_type.decode('utf-8', 'replace')
+
+        entries.append((
+            timestamp, decoded_type, message.decode('utf-8', 'replace')))
+
+    return entries
+
+
+class Segment(object):
+    """
+    Segment file of the archive, with the blocks it has.
+
+    :var str path: location of the segment
+    :var str tokens_path: location of the index tokens of its blocks
+    :var list blocks: (start, end, offset, count) tuples for each block,
+      with the time range of its entries, where it is in the file and how
+      many entries it has
+    :var int size: size of the file in bytes
+    """
+
+    def __init__(self, path):
+        """
+        Opens a segment file, creating it if it doesn't exist. Our blocks
+        are found from their headers, without reading their content. Only
+        the last block can be partially written (from a crash while
+        appending to it), so its checksum is verified and it's discarded if
+        it doesn't match. Other blocks are verified as they're read.
+
+        :param str path: location of the segment.
+
+        :raises: **IOError** or **OSError** if the segment can't be read.
+        """
+
+        self.path = path
+        self.tokens_path = path[:-len(SEGMENT_SUFFIX)] + TOKENS_SUFFIX
+        self.blocks = []
+        self.size = 0
+
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+
+        with open(path, 'r+b') as segment_file:
+            file_size = os.fstat(segment_file.fileno()).st_size
+
+            while self.size + BLOCK.size <= file_size:
+                segment_file.seek(self.size)
+                header = BLOCK.unpack(segment_file.read(BLOCK.size))
+                magic, start, end, count, length, checksum = header
+
+                if magic != BLOCK_MAGIC or \
+                        self.size + BLOCK.size + length > file_size:
+                    break
+
+                self.blocks.append((start, end, self.size, count))
+                self.size += BLOCK.size + length
+                last_checksum = checksum
+
+            if self.blocks:
+                length = self.size - self.blocks[-1][2] - BLOCK.size
+                segment_file.seek(self.blocks[-1][2] + BLOCK.size)
+                content = segment_file.read(length)
+
+                if zlib.crc32(content) & 0xffffffff != last_checksum:
+                    self.size = self.blocks.pop()[2]
+
+            if self.size != file_size:
+                segment_file.truncate(self.size)
+
+    @property
+    def start(self):
+        return min(block[0] for block in self.blocks) if self.blocks else None
+
+    @property
+    def end(self):
+        return max(block[1] for block in self.blocks) if self.blocks else None
+
+    def append(self, entries, tokens):
+        """
+        Compresses entries into a new block at the end of the segment. The
+        block isn't one of our blocks until it's added to them, so readers
+        don't see it while it's written.
+
+        If the block can't be fully written the segment is truncated back,
+        so no partial block is left for the next one to follow. Failing to
+        write the block's tokens doesn't fail the append, since they're
+        rebuilt from the block when the segment is next loaded.
+
+        :param list entries: **list** of (timestamp, type, message) tuples.
+        :param set tokens: index tokens of the entries.
+
+        :returns: **tuple** with the new block, to be added to our blocks
+
+        :raises: **IOError** or **OSError** if the block can't be written
+        """
+
+        content = zlib.compress(encode_entries(entries))
+        timestamps = [entry[0] for entry in entries]
+        start, end = min(timestamps), max(timestamps)
+
+        header = BLOCK.pack(
+            BLOCK_MAGIC, start, end, len(entries), len(content),
+            zlib.crc32(content) & 0xffffffff)
+
+        with open(self.path, 'ab') as segment_file:
+            segment_file.seek(0, os.SEEK_END)
+
+            try:
+                if segment_file.tell() != self.size:
+                    segment_file.truncate(self.size)
+
+                segment_file.write(header + content)
+                segment_file.flush()
+            except (IOError, OSError):
+                _truncate(segment_file, self.size)
+                raise
+
+        block = (start, end, self.size, len(entries))
+        self.size += len(header) + len(content)
+
+        try:
+            with open(self.tokens_path, 'ab') as tokens_file:
+                tokens_file.seek(0, os.SEEK_END)
+                tokens_size = tokens_file.tell()
+
+                try:
+                    tokens_file.write(self._tokens_record(block[2], tokens))
+                    tokens_file.flush()
+                except (IOError, OSError):
+                    _truncate(tokens_file, tokens_size)
+                    raise
+        except (IOError, OSError):
+            pass
+
+        return block
+
+    def block_tokens(self):
+        """
+        Provides the index tokens of each block. Blocks missing from our
+        tokens file (if we crashed before writing them) are read to get
+        their tokens, which are then added to the file. Blocks we can't
+        read have no tokens.
+
+        :returns: **list** of (block, tokens) tuples
+        """
+
+        known, valid_size = {}, 0
+
+        try:
+            with open(self.tokens_path, 'rb') as tokens_file:
+                content = tokens_file.read()
+        except IOError:
+            content = b''
+
+        while valid_size + TOKENS.size <= len(content):
+            offset, length, checksum = TOKENS.unpack_from(content, valid_size)
+            start = valid_size + TOKENS.size
+            data = content[start:start + length]
+
+            if len(data) != length or \
+                    zlib.crc32(data) & 0xffffffff != checksum:
+                break
+
+            tokens = zlib.decompress(data).decode('utf-8').split(u'\n')
+            known[offset] = set(tokens)
+            valid_size = start + length
+
+        result, missing = [], []
+
+        for block in self.blocks:
+            tokens = known.get(block[2])
+
+            if tokens is None:
+                tokens = set()
+
+                try:
+                    entries = self.read_block(block)
+                except (IOError, zlib.error):
+                    entries = None
+
+                if entries is not None:
+                    for _, event_type, message in entries:
+                        tokens.update(index_tokens(event_type, message))
+
+                    missing.append(self._tokens_record(block[2], tokens))
+
+            result.append((block, tokens))
+
+        if missing or valid_size != len(content):
+            with open(self.tokens_path, 'ab') as tokens_file:
+                tokens_file.truncate(valid_size)
+                tokens_file.write(b''.join(missing))
+
+        return result
+
+    @staticmethod
+    def _tokens_record(offset, tokens):
+        data = zlib.compress(u'\n'.join(
+            token.decode('utf-8') if isinstance(token, bytes) else token
+            for token in tokens).encode('utf-8'))
+
+        return TOKENS.pack(offset, len(data), zlib.crc32(data) & 0xffffffff) \
+            + data
+
+    def read_block(self, block, accept=None):
+        """
+        Provides the entries of a block.
+
+        :param tuple block: block to read, from our blocks attribute.
+        :param func accept: check of each entry's encoded message, as
+          described by :func:`~erebus.server.handlers.archive.decode_entries`
+
+        :returns: **list** of (timestamp, type, message) tuples
+
+        :raises: **IOError** if the block is malformed or can't be read
+        """
+
+        with open(self.path, 'rb') as segment_file:
+            segment_file.seek(block[2])
+            header = segment_file.read(BLOCK.size)
+
+            if len(header) == BLOCK.size:
+                magic, _, _, _, length, checksum = BLOCK.unpack(header)
+                content = segment_file.read(length)
+
+                if magic == BLOCK_MAGIC and len(content) == length and \
+                        zlib.crc32(content) & 0xffffffff == checksum:
+                    return decode_entries(zlib.decompress(content), accept)
+
+        raise IOError('malformed block at offset %i' % block[2])
+
+
+def _truncate(open_file, size):
+    # Best effort, we're already handling a failed write.
+
+    try:
+        open_file.truncate(size)
+    except (IOError, OSError):
+        pass
+
+
+class LogArchive(object):
+    """
+    Append-only archive of log entries, kept in a directory of segments.
+
+    Entries are gathered in memory until there's `log.archive.blockSize`
+    bytes of them (or `log.archive.sync` seconds pass), then written as a
+    compressed block by a thread, one block at a time. New segments are
+    started every `log.archive.segmentSize` bytes or
+    `log.archive.segmentAge` seconds, and the oldest are removed when the
+    archive exceeds `log.archive.maxSize` bytes or they end over
+    `log.archive.maxAge` seconds ago.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the archive, creating its directory if it doesn't exist.
+
+        :param str path: directory of the archive.
+
+        :raises: **IOError** or **OSError** if the archive can't be opened.
+        """
+
+        self.path = path
+        self._segments = []
+        self._pending = []
+        self._pending_size = 0
+        self._pending_tokens = set()
+        self._lock = threading.RLock()
+        self._index = LogIndex()
+
+        # Every entry has a position, counting the entries added since the
+        # oldest one we have. Our blocks are kept as (position of their
+        # first entry, segment, block) tuples in the order they were added.
+        self._blocks = []
+        self._next_position = 0
+
+        # Entries handed to our writer thread which aren't in a block of
+        # ours yet (with the position of the first of them), and the chain
+        # of writes they're waiting on.
+        self._writing = []
+        self._writes = defer.succeed(None)
+
+        # After a failed write we don't try again until this time.
+        self._retry_at = 0
+        self._dropped = 0
+
+        # Our own messages are logged like any other erebus event, and come
+        # back to be archived. They aren't, as failing to write them would
+        # log them again.
+        self._own_messages = set()
+
+        self._sync_call = task.LoopingCall(self.flush)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(SEGMENT_SUFFIX):
+                self._segments.append(
+                    Segment(os.path.join(path, filename)))
+
+        self._expire()
+
+        for segment in self._segments:
+            for block, tokens in segment.block_tokens():
+                self._index.add((segment, block), tokens)
+                self._blocks.append((self._next_position, segment, block))
+                self._next_position += block[3]
+
+        log.info(msg(
+            'log.archive_loaded', path=path, segments=len(self._segments),
+            entries=sum(block[3] for segment in self._segments
+                        for block in segment.blocks)))
+
+        reactor.callWhenRunning(
+            self._sync_call.start, CONFIG['log.archive.sync'], now=False)
+
+    def add(self, entry):
+        """
+        Adds a log entry to the archive. This should only be called from the
+        reactor thread.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+
+        :returns: **int** with the entry's position in the archive, or
+          **None** if it isn't archived
+        """
+
+        with self._lock:
+            if entry.message in self._own_messages:
+                return None
+
+            position = self._next_position
+            self._next_position += 1
+
+            self._pending.append((entry.timestamp, entry.type, entry.message))
+            self._pending_size += ENTRY.size + len(entry.message)
+            self._pending_tokens.update(
+                index_tokens(entry.type, entry.message))
+
+            is_full = self._pending_size >= CONFIG['log.archive.blockSize']
+
+        # Entries are also flushed every `log.archive.sync` seconds by our
+        # looping call.
+
+        if is_full:
+            self.flush()
+
+        return position
+
+    def flush(self):
+        """
+        Hands the entries we've gathered to our writer thread. This should
+        only be called from the reactor thread.
+        """
+
+        with self._lock:
+            if not self._pending or time.time() < self._retry_at:
+                return
+
+            batch = (self._next_position - len(self._pending),
+                     self._pending, self._pending_tokens)
+            self._writing.append(batch[:2])
+            self._pending, self._pending_size = [], 0
+            self._pending_tokens = set()
+
+        self._writes.addCallback(
+            lambda ignored: threads.deferToThread(self._write, *batch))
+        self._writes.addErrback(self._write_error)
+
+    def _write(self, first_position, entries, tokens):
+        """
+        Writes entries as a block of our newest segment, starting a new
+        segment if it's too large or old. This is run by our writer thread.
+
+        :param int first_position: position of the first entry.
+        :param list entries: **list** of (timestamp, type, message) tuples.
+        :param set tokens: index tokens of the entries.
+        """
+
+        segment, path = None, self.path
+
+        try:
+            with self._lock:
+                segment = self._segments[-1] if self._segments else None
+
+                if segment is None or (segment.blocks and (
+                        segment.size >= CONFIG['log.archive.segmentSize'] or
+                        time.time() - segment.start >=
+                        CONFIG['log.archive.segmentAge'])):
+                    segment = self._new_segment()
+
+            path = segment.path
+            block = segment.append(entries, tokens)
+        except (IOError, OSError) as exc:
+            with self._lock:
+                self._writing.remove((first_position, entries))
+                self._retry_at = time.time() + CONFIG['log.archive.sync']
+                self._dropped += len(entries)
+
+            self._log(log.notice, msg(
+                'log.archive_write_failed', path=path, error=exc,
+                count=len(entries)))
+            return
+
+        with self._lock:
+            segment.blocks.append(block)
+            self._blocks.append((first_position, segment, block))
+            self._index.add((segment, block), tokens)
+            self._writing.remove((first_position, entries))
+            self._own_messages.clear()
+            self._expire()
+
+    def _write_error(self, failure):
+        # Unexpected errors of our writer thread. The chain of writes needs
+        # to carry on regardless.
+
+        self._log(log.notice, msg(
+            'log.archive_write_failed', path=self.path,
+            error=failure.getErrorMessage(), count=0))
+
+    def _log(self, logger, message):
+        with self._lock:
+            self._own_messages.add(message)
+
+        logger(message)
+
+    def page(self, limit, before=None, types=None):
+        """
+        Provides the newest archived entries that arrived before a position
+        of the archive. Blocks are read from newest to oldest, until we have
+        enough entries.
+
+        :param int limit: maximum number of entries to provide.
+        :param int before: position entries must be before, as provided by
+          :func:`~erebus.server.handlers.archive.LogArchive.add`, or the
+          newest entry if not provided.
+        :param set types: event types to provide, or all of them if not
+          provided.
+
+        :returns: **list** of (position, (timestamp, type, message)) tuples,
+          from newest to oldest
+        """
+
+        result = []
+
+        def collect(position, entry):
+            if (before is None or position < before) and \
+                    (not types or entry[1] in types):
+                result.append((position, entry))
+
+            return len(result) >= limit
+
+        with self._lock:
+            unwritten = self._unwritten_items()
+            blocks = list(self._blocks)
+            typed = set(self._index.candidates((), types)) if types else None
+
+        for position, entry in reversed(unwritten):
+            if collect(position, entry):
+                return result
+
+        for first_position, segment, block in reversed(blocks):
+            if before is not None and first_position >= before:
+                continue
+            elif typed is not None and (segment, block) not in typed:
+                continue
+
+            try:
+                entries = segment.read_block(block)
+            except (IOError, OSError, zlib.error) as exc:
+                self._log(log.info, msg(
+                    'log.archive_read_failed', path=segment.path, error=exc))
+                continue
+
+            for index in range(len(entries) - 1, -1, -1):
+                if collect(first_position + index, entries[index]):
+                    return result
+
+        return result
+
+    def search(self, phrases, start=None, end=None, types=None, limit=None):
+        """
+        Provides the newest archived entries matching a query. Only the
+        blocks the index has all of the query's words in are read.
+
+        :param list phrases: terms of the query, as provided by
+          :func:`~erebus.server.handlers.search.parse_query`.
+        :param float start: unix timestamp where the range starts, or the
+          beginning of the archive if not provided.
+        :param float end: unix timestamp where the range ends, or now if not
+          provided.
+        :param set types: event types to provide, or all of them if not
+          provided.
+        :param int limit: maximum number of entries to provide.
+
+        :returns: **tuple** of the form (entries, truncated) with a **list**
+          of (timestamp, type, message) tuples from newest to oldest, and
+          **True** if there were more matches than our limit
+        """
+
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+
+        def matching(entries):
+            return [
+                entry for entry in reversed(entries)
+                if start <= entry[0] <= end and
+                (not types or entry[1] in types) and
+                matches(phrases, entry[2])]
+
+        # Messages lacking any of the query's words can be skipped before
+        # decoding them. Lowercasing encoded messages only works for ascii,
+        # so other words are left to the full check.
+
+        words = set(word for phrase in phrases for word in phrase)
+
+        try:
+            encoded = [word.encode('ascii') for word in words]
+        except UnicodeError:
+            encoded = None
+
+        if encoded:
+            def accept(message):
+                lowered = message.lower()
+                return all(word in lowered for word in encoded)
+        else:
+            accept = None
+
+        with self._lock:
+            result = matching(self._unwritten())
+            candidates = self._index.candidates(query_words(phrases), types)
+
+        for segment, block in candidates:
+            if limit is not None and len(result) > limit:
+                break
+            elif block[1] < start or block[0] > end:
+                continue
+
+            try:
+                result += matching(segment.read_block(block, accept))
+            except (IOError, OSError, zlib.error) as exc:
+                # the segment might have expired since we got the candidates
+                self._log(log.info, msg(
+                    'log.archive_read_failed', path=segment.path, error=exc))
+
+        result.sort(key=lambda entry: entry[0], reverse=True)
+
+        if limit is not None and len(result) > limit:
+            return result[:limit], True
+
+        return result, False
+
+    def stats(self):
+        """
+        Provides the size of the archive.
+
+        :returns: **dict** with the number of segments, blocks, entries and
+          bytes in the archive
+        """
+
+        with self._lock:
+            blocks = [b for segment in self._segments for b in segment.blocks]
+
+            return {
+                'segments': len(self._segments),
+                'blocks': len(blocks),
+                'entries': sum(block[3] for block in blocks),
+                'pending': len(self._pending),
+                'writing': sum(len(batch[1]) for batch in self._writing),
+                'dropped': self._dropped,
+                'bytes': sum(segment.size for segment in self._segments),
+                'index': self._index.stats(),
+            }
+
+    def close(self):
+        """
+        Writes any entries we've gathered to disk.
+
+        :returns: **Deferred** which fires once our writes are done
+        """
+
+        if self._sync_call.running:
+            self._sync_call.stop()
+
+        self._retry_at = 0
+        self.flush()
+
+        done = defer.Deferred()
+        self._writes.addBoth(lambda ignored: done.callback(None))
+        return done
+
+    def _unwritten(self):
+        """
+        Provides the entries that aren't in a block of ours yet. Our lock
+        must be held.
+
+        :returns: **list** of (timestamp, type, message) tuples, from oldest
+          to newest
+        """
+
+        entries = []
+
+        for _, batch in self._writing:
+            entries += batch
+
+        return entries + self._pending
+
+    def _unwritten_items(self):
+        """
+        Provides the entries that aren't in a block of ours yet, with their
+        positions. Our lock must be held.
+
+        :returns: **list** of (position, (timestamp, type, message)) tuples,
+          from oldest to newest
+        """
+
+        items = []
+
+        for first_position, batch in self._writing:
+            items += enumerate(batch, first_position)
+
+        pending_position = self._next_position - len(self._pending)
+        return items + list(enumerate(self._pending, pending_position))
+
+    def _new_segment(self):
+        if self._segments:
+            number = int(os.path.basename(self._segments[-1].path).split(
+                '.')[0]) + 1
+        else:
+            number = 1
+
+        segment = Segment(os.path.join(
+            self.path, '%010i%s' % (number, SEGMENT_SUFFIX)))
+        self._segments.append(segment)
+        return segment
+
+    def _expire(self):
+        """
+        Removes the oldest segments while we exceed our size or age limit.
+        The segment being written to is never removed.
+        """
+
+        now = time.time()
+
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            total_size = sum(segment.size for segment in self._segments)
+
+            too_large = CONFIG['log.archive.maxSize'] and \
+                total_size > CONFIG['log.archive.maxSize']
+            too_old = CONFIG['log.archive.maxAge'] and (
+                not oldest.blocks or
+                now - oldest.end > CONFIG['log.archive.maxAge'])
+
+            if not (too_large or too_old):
+                break
+
+            try:
+                os.remove(oldest.path)
+                if os.path.exists(oldest.tokens_path):
+                    os.remove(oldest.tokens_path)
+            except OSError as exc:
+                self._log(log.info, msg(
+                    'log.archive_remove_failed', path=oldest.path, error=exc))
+                break
+
+            self._segments.pop(0)
+            self._index.expire(len(oldest.blocks))
+
+            while self._blocks and self._blocks[0][1] is oldest:
+                self._blocks.pop(0)
@@ -14,11 +14,38 @@ Bandwidth-related functions, including read/written (current, avg, total)
 bytes, limit, burst, etc.
 """
 
+import threading
 import time
 
-from stem.util import log, str_tools, system
+from stem.control import EventType
+from stem.util import conf, log, str_tools, system
+from twisted.internet import reactor, threads
 
 from erebus.util import msg, tor_controller
+from erebus.util.cache import QueryCache
+
+
+def conf_handler(key, value):
+    if key == 'bw.cache.ttl':
+        return max(0, value)
+    elif key == 'bw.traffic.resync':
+        return max(1, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'bw.cache.ttl': 300,
+    'bw.traffic.resync': 600,
+}, conf_handler)
+
+# Cached queries which must be refreshed when a tor event arrives.
+INVALIDATED_BY = {
+    EventType.CONF_CHANGED: ('limit', 'burst'),
+    EventType.NEWCONSENSUS: ('network_status',),
+    EventType.NEWDESC: ('server_descriptor',),
+}
+
+# Placeholder for results missing from our cache.
+MISSING = object()
 
 BW_HANDLER = None
 
@@ -51,10 +78,49 @@ class BWHandler():
     def __init__(self):
         """
         Saves start time of tor controll connection, so we can further
-        calculate average values during time.
+        calculate average values during time. Rate limits, our consensus
+        entry and our descriptor rarely change, so they're cached until
+        tor tells us otherwise.
+        """
+
+        controller = tor_controller()
+        self._start_time = system.start_time(controller.get_pid(None))
+        self._fingerprint = controller.get_info('fingerprint', None)
+
+        self._cache = QueryCache(CONFIG['bw.cache.ttl'])
+        controller.add_event_listener(
+            self._invalidate_cache, *INVALIDATED_BY.keys())
+
+        self._traffic = TrafficAccumulator()
+
+    def _invalidate_cache(self, event):
+        """
+        Drops the cached queries affected by a tor event.
+
+        :param Class event: :class:`~stem.response.events.Event`
+          delivered by stem.
         """
 
-        self._start_time = system.start_time(tor_controller().get_pid(None))
+        if event.type == EventType.NEWDESC:
+            # Only our own descriptor matters.
+            fingerprints = [relay[0] for relay in event.relays]
+            if self._fingerprint not in fingerprints:
+                return
+
+        self._cache.invalidate(*INVALIDATED_BY.get(event.type, ()))
+
+    def stats(self):
+        """
+        Provides hits and misses of our cached queries, and the drift found
+        between our traffic totals and tor's.
+
+        :returns: **dict** with the bandwidth handler statistics.
+        """
+
+        return {
+            'cache': self._cache.stats(),
+            'traffic': self._traffic.stats(),
+        }
 
     def get_cache(self):
         """
@@ -92,10 +158,9 @@ class BWHandler():
                 log.info(msg('bw.cache_success', duration=str_tools.time_label(
                     len(bw_entries.split()), is_long=True)))
 
-            read_total = controller.get_info('traffic/read', None)
-            write_total = controller.get_info('traffic/written', None)
+            read_total, write_total = self._traffic.totals()
 
-            if read_total and write_total:
+            if read_total is not None and write_total is not None:
                 output['read_total'] = read_total
                 output['write_total'] = write_total
 
@@ -103,7 +168,9 @@ class BWHandler():
 
     def get_info(self, event):
         """
-        Receive bandwidth event and retrieve useful info.
+        Receive bandwidth event and retrieve useful info. This doesn't query
+        tor, values we don't have cached are omitted until
+        :func:`~erebus.server.handlers.graph.BWHandler.refresh` fetches them.
 
         :param Class event: :class:`~stem.response.events.Event`
           delivered by stem.
@@ -117,12 +184,10 @@ class BWHandler():
             'written': event.written
         }
 
-        controller = tor_controller()
-
-        read_total = controller.get_info('traffic/read', None)
-        write_total = controller.get_info('traffic/written', None)
+        self._traffic.add(event.read, event.written)
+        read_total, write_total = self._traffic.totals()
 
-        if read_total and write_total:
+        if read_total is not None and write_total is not None:
             output['read_total'] = read_total
             output['write_total'] = write_total
 
@@ -130,22 +195,188 @@ class BWHandler():
             output['read_avg'] = float(read_total) / time_window
             output['write_avg'] = float(write_total) / time_window
 
-        bw_rate = controller.get_effective_rate(None)
-        bw_burst = controller.get_effective_rate(None, burst=True)
+        bw_rate = self._cache.cached('limit')
+        bw_burst = self._cache.cached('burst')
 
         if bw_rate and bw_burst:
             output['limit'] = bw_rate
             output['burst'] = bw_burst
 
-        router_status_entry = controller.get_network_status(default=None)
+        router_status_entry = self._cache.cached('network_status')
         measured_bw = getattr(router_status_entry, 'bandwidth', None)
 
         if measured_bw:
             output['measured'] = measured_bw
         else:
-            server_desc = controller.get_server_descriptor(default=None)
+            server_desc = self._cache.cached('server_descriptor')
             observed_bw = getattr(server_desc, 'observed_bandwidth', None)
             if observed_bw:
                 output['observed'] = observed_bw
 
         return output
+
+    def needs_refresh(self):
+        """
+        Checks if any of the values of our BW-EVENT messages need to be
+        fetched from tor.
+
+        :returns: **True** if we should be refreshed, **False** otherwise
+        """
+
+        keys = ['limit', 'burst', 'network_status']
+
+        # Without a measured bandwidth we provide the observed one, whose
+        # descriptor is dropped from our cache on NEWDESC events.
+        router_status_entry = self._cache.cached('network_status')
+
+        if not getattr(router_status_entry, 'bandwidth', None):
+            keys.append('server_descriptor')
+
+        for key in keys:
+            if self._cache.cached(key, MISSING) is MISSING:
+                return True
+
+        return self._traffic.needs_sync()
+
+    def refresh(self):
+        """
+        Fetches the values of our BW-EVENT messages we don't have cached,
+        and resyncs our traffic totals if they're due. This queries tor, so
+        it's run through the query executor.
+        """
+
+        controller = tor_controller()
+
+        self._cache.get(
+            'limit', lambda: controller.get_effective_rate(None))
+        self._cache.get(
+            'burst', lambda: controller.get_effective_rate(None, burst=True))
+
+        router_status_entry = self._cache.get(
+            'network_status',
+            lambda: controller.get_network_status(default=None))
+
+        if not getattr(router_status_entry, 'bandwidth', None):
+            self._cache.get(
+                'server_descriptor',
+                lambda: controller.get_server_descriptor(default=None))
+
+        if self._traffic.needs_sync():
+            self._traffic.sync()
+
+
+class TrafficAccumulator(object):
+    """
+    Running totals of read and written bytes. They're seeded with a single
+    GETINFO when tor's connection is made and then kept up to date with BW
+    events, so tor doesn't need to be queried on every event. Every
+    `bw.traffic.resync` seconds the totals should be checked against tor's
+    (see needs_sync()), and any drift found is logged.
+
+    BW events are only added on the reactor thread, where our totals are
+    also corrected.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._read_total = None
+        self._write_total = None
+        self._last_sync = time.time()
+
+        self._drift = {'read': 0, 'written': 0, 'resyncs': 0}
+
+        tor_totals = self._tor_totals()
+        if tor_totals is not None:
+            self._read_total, self._write_total = tor_totals
+
+    def add(self, read, written):
+        """
+        Adds the bytes of a BW event to our totals.
+
+        :param int read: bytes read.
+        :param int written: bytes written.
+        """
+
+        with self._lock:
+            if self._read_total is not None:
+                self._read_total += read
+                self._write_total += written
+
+    def needs_sync(self):
+        """
+        Checks if it's time to check our totals against tor's.
+
+        :returns: **True** if we should sync, **False** otherwise
+        """
+
+        return time.time() - self._last_sync >= CONFIG['bw.traffic.resync']
+
+    def sync(self):
+        """
+        Checks our totals against tor's traffic/read and traffic/written,
+        and corrects any drift. This queries tor, so it's called from a
+        thread rather than the reactor.
+        """
+
+        self._last_sync = time.time()
+
+        # BW events keep being added while we query tor, so our totals are
+        # read on the reactor right before the query, and only the drift
+        # from them is applied. Events added meanwhile are kept.
+        before = threads.blockingCallFromThread(reactor, self.totals)
+        tor_totals = self._tor_totals()
+
+        if tor_totals is not None:
+            reactor.callFromThread(self._correct, before, tor_totals)
+
+    def _tor_totals(self):
+        controller = tor_controller()
+        totals = controller.get_info(['traffic/read', 'traffic/written'], {})
+
+        try:
+            return int(totals['traffic/read']), int(totals['traffic/written'])
+        except (KeyError, ValueError):
+            return None
+
+    def _correct(self, before, tor_totals):
+        read_total, write_total = tor_totals
+
+        with self._lock:
+            if self._read_total is None or None in before:
+                self._read_total, self._write_total = read_total, write_total
+                return
+
+            read_drift = read_total - before[0]
+            write_drift = write_total - before[1]
+
+            self._read_total += read_drift
+            self._write_total += write_drift
+
+            self._drift['read'] += read_drift
+            self._drift['written'] += write_drift
+            self._drift['resyncs'] += 1
+
+        if read_drift or write_drift:
+            log.info(msg(
+                'bw.traffic_drift', read=read_drift, written=write_drift))
+
+    def totals(self):
+        """
+        Provides our read and written totals.
+
+        :returns: **tuple** of the form (read, written), with **None**
+          values if tor's totals couldn't be fetched yet.
+        """
+
+        with self._lock:
+            return self._read_total, self._write_total
+
+    def stats(self):
+        """
+        Provides the accumulated drift found when resyncing with tor.
+
+        :returns: **dict** with the drift statistics.
+        """
+
+        with self._lock:
+            return dict(self._drift)
@@ -0,0 +1,462 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Bandwidth history, kept at several resolutions (RRD-style). Each resolution
+is a fixed size ring buffer, so memory usage doesn't grow with uptime. The
+history can be memory-mapped to a file so it survives restarts.
+"""
+
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from stem.util import conf, log
+
+from erebus.util import msg
+
+
+def conf_handler(key, value):
+    if key == 'bw.history.sync':
+        return max(1, value)
+    elif key == 'bw.range.maxPoints':
+        return max(3, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'bw.history.path': '~/.erebus/bw_history',
+    'bw.history.sync': 60,
+    'bw.range.maxPoints': 1000,
+}, conf_handler)
+
+BW_HISTORY = None
+
+# Resolutions of our history, as (seconds per sample, number of samples):
+# 1 second for an hour, 1 minute for a day, 15 minutes for 30 days and
+# 1 hour for a year.
+LEVELS = (
+    (1, 3600),
+    (60, 1440),
+    (900, 2880),
+    (3600, 8760),
+)
+
+# Each sample is consolidated as: start of its interval, number of BW
+# events consolidated, and min/avg/max of both read and written bytes.
+RECORD = struct.Struct('<qI6d')
+
+# Header of history files: magic, format version, checksum of our layout,
+# sequence number, read and written totals, last update and a checksum of
+# the header itself. Files have two header slots which are written
+# alternately, so a crash while writing one leaves the other intact.
+HEADER = struct.Struct('<8sIIQqqqI')
+HEADER_MAGIC = b'EREBUSBW'
+HEADER_VERSION = 1
+
+# Samples start at the first page after the headers.
+SAMPLES_OFFSET = mmap.PAGESIZE
+
+
+def bw_history():
+    """
+    Provides the BW_HISTORY singleton.
+
+    :returns: :class:`~erebus.server.handlers.history.BandwidthHistory`
+    """
+
+    return BW_HISTORY
+
+
+def init_bw_history():
+    """
+    Initializes the bandwidth history instance. Unlike the bandwidth
+    handler, this is kept when the connection to tor is lost.
+    """
+
+    global BW_HISTORY
+    path = CONFIG['bw.history.path']
+
+    if path:
+        path = os.path.expanduser(path)
+        try:
+            BW_HISTORY = MappedBandwidthHistory(path)
+            return
+        except (IOError, OSError, mmap.error) as exc:
+            log.notice(msg('bw.history_unavailable', path=path, error=exc))
+
+    BW_HISTORY = BandwidthHistory()
+
+
+def get_range(start, end=None, points=None):
+    """
+    Provides the bandwidth history within a time range, downsampled to
+    the given number of points.
+
+    :param int start: unix timestamp where the range starts.
+    :param int end: unix timestamp where the range ends, or now if not
+      provided.
+    :param int points: maximum number of points to provide, capped to
+      `bw.range.maxPoints`.
+
+    :returns: dictionary with the bandwidth history entries.
+    """
+
+    end = int(time.time() if end is None else end)
+    points = min(points or CONFIG['bw.range.maxPoints'],
+                 CONFIG['bw.range.maxPoints'])
+
+    output = {
+        'header': 'BW-RANGE',
+        'from': start,
+        'to': end,
+        'step': None,
+        'entries': []
+    }
+
+    if BW_HISTORY is not None:
+        step, samples = BW_HISTORY.fetch(start, end)
+        samples = [(sample[0], (sample[3], sample[6])) for sample in samples]
+
+        output['step'] = step
+        output['entries'] = [
+            {'time': timestamp, 'read': read, 'written': written}
+            for timestamp, (read, written) in downsample(samples, points)]
+
+    return output
+
+
+def downsample(points, threshold):
+    """
+    Reduces a series to the given number of points while keeping its visual
+    shape, with the Largest-Triangle-Three-Buckets algorithm. The series
+    can have several y values per point (like read and written bytes), in
+    which case the point picked from each bucket is the one adding the
+    largest triangles across all of them.
+
+    :param list points: series as **tuples** of the form (x, (y1, y2...)),
+      sorted by x.
+    :param int threshold: number of points to keep.
+
+    :returns: **list** with the kept points.
+    """
+
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = float(len(points) - 2) / (threshold - 2)
+    previous = points[0]
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average point of the next bucket, the third vertex of our triangles.
+        next_points = points[end:int((bucket + 2) * bucket_size) + 1]
+        if not next_points:
+            next_points = points[-1:]
+
+        avg_x = float(sum([p[0] for p in next_points])) / len(next_points)
+        avg_ys = [float(sum(ys)) / len(next_points)
+                  for ys in zip(*[p[1] for p in next_points])]
+
+        best, best_area = None, -1
+
+        for point in points[start:end]:
+            area = 0
+            for prev_y, y, avg_y in zip(previous[1], point[1], avg_ys):
+                area += abs((previous[0] - avg_x) * (y - prev_y) -
+                            (previous[0] - point[0]) * (avg_y - prev_y))
+
+            if area > best_area:
+                best, best_area = point, area
+
+        sampled.append(best)
+        previous = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class Archive(object):
+    """
+    Ring buffer of bandwidth samples at a single resolution. Samples are
+    consolidated incrementally into the slot of their interval as BW events
+    arrive.
+
+    :var int step: seconds covered by each sample.
+    :var int size: number of samples kept.
+    """
+
+    def __init__(self, step, size, buf, offset):
+        """
+        :param int step: seconds covered by each sample.
+        :param int size: number of samples kept.
+        :param bytearray buf: buffer where samples are stored.
+        :param int offset: position of our first sample in the buffer.
+        """
+
+        self.step = step
+        self.size = size
+        self._buffer = buf
+        self._offset = offset
+
+    def _position(self, start):
+        return self._offset + (start // self.step) % self.size * RECORD.size
+
+    def update(self, timestamp, read, written):
+        """
+        Consolidates a BW event into the sample of its interval.
+
+        :param int timestamp: unix timestamp of the event.
+        :param int read: bytes read.
+        :param int written: bytes written.
+        """
+
+        start = timestamp - timestamp % self.step
+        position = self._position(start)
+        sample = RECORD.unpack_from(self._buffer, position)
+
+        if sample[0] != start:
+            # This slot holds an old sample of a previous lap.
+            RECORD.pack_into(
+                self._buffer, position, start, 1,
+                read, read, read, written, written, written)
+        else:
+            count = sample[1] + 1
+            RECORD.pack_into(
+                self._buffer, position, start, count,
+                min(sample[2], read),
+                sample[3] + (read - sample[3]) / count,
+                max(sample[4], read),
+                min(sample[5], written),
+                sample[6] + (written - sample[6]) / count,
+                max(sample[7], written))
+
+    def fetch(self, start, end):
+        """
+        Provides the samples within a time range, oldest first. Intervals
+        without samples are skipped.
+
+        :param int start: unix timestamp where the range starts.
+        :param int end: unix timestamp where the range ends.
+
+        :returns: **list** of **tuples** of the form (timestamp, count,
+          read_min, read_avg, read_max, written_min, written_avg,
+          written_max)
+        """
+
+        samples = []
+        start = max(start, end - self.step * (self.size - 1))
+        start -= start % self.step
+
+        for interval in range(start, end + 1, self.step):
+            sample = RECORD.unpack_from(self._buffer, self._position(interval))
+            if sample[0] == interval:
+                samples.append(sample)
+
+        return samples
+
+
+class BandwidthHistory(object):
+    """
+    Bandwidth samples at each of our LEVELS of resolution. All the samples
+    live in a single buffer allocated upfront, so memory usage is fixed
+    (about 1 MB).
+    """
+
+    def __init__(self, buf=None, offset=0):
+        """
+        :param bytearray buf: buffer for our samples, a new one is allocated
+          if not provided.
+        :param int offset: position of the samples in the buffer.
+        """
+
+        if buf is None:
+            buf = bytearray(self.buffer_size())
+
+        # Totals of every BW event we added.
+        self.read_total = 0
+        self.written_total = 0
+        self.last_update = 0
+
+        self._archives = []
+
+        for step, size in LEVELS:
+            self._archives.append(Archive(step, size, buf, offset))
+            offset += size * RECORD.size
+
+    @staticmethod
+    def buffer_size():
+        """
+        Provides the bytes needed to store the samples of every level.
+
+        :returns: **int** with the buffer size.
+        """
+
+        return sum([size for step, size in LEVELS]) * RECORD.size
+
+    def add(self, timestamp, read, written):
+        """
+        Adds a BW event to every resolution.
+
+        :param float timestamp: unix timestamp of the event.
+        :param int read: bytes read.
+        :param int written: bytes written.
+        """
+
+        timestamp = int(timestamp)
+        for archive in self._archives:
+            archive.update(timestamp, read, written)
+
+        self.read_total += read
+        self.written_total += written
+        self.last_update = timestamp
+
+    def fetch(self, start, end=None):
+        """
+        Provides the samples within a time range, using the finest
+        resolution that still covers its start.
+
+        :param int start: unix timestamp where the range starts.
+        :param int end: unix timestamp where the range ends, or now if
+          not provided.
+
+        :returns: **tuple** of the form (step, samples), where samples are
+          as provided by :func:`~erebus.server.handlers.history.Archive.fetch`
+        """
+
+        end = int(time.time() if end is None else end)
+        start = int(start)
+
+        for archive in self._archives:
+            if start >= end - archive.step * archive.size:
+                break
+
+        return archive.step, archive.fetch(start, end)
+
+    def close(self):
+        """
+        Releases resources of our history, if any.
+        """
+
+        pass
+
+
+class MappedBandwidthHistory(BandwidthHistory):
+    """
+    Bandwidth history memory-mapped to a file of fixed size. Samples are
+    written in place as they arrive, so only the pages we touch are ever
+    written back to disk, and reopening the file needs no parsing beyond
+    its header.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a history file, creating it if it doesn't exist or doesn't
+        match our layout.
+
+        :param str path: location of the history file.
+
+        :raises: **IOError**, **OSError** or **mmap.error** if the file
+          can't be opened or created.
+        """
+
+        file_size = SAMPLES_OFFSET + self.buffer_size()
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self._file = open(path, mode)
+
+        if os.fstat(self._file.fileno()).st_size != file_size:
+            self._file.truncate(0)
+            self._file.truncate(file_size)
+
+        self._map = mmap.mmap(self._file.fileno(), file_size)
+        self._last_sync = time.time()
+
+        BandwidthHistory.__init__(self, self._map, SAMPLES_OFFSET)
+
+        header = self._read_header()
+        if header is None:
+            log.info(msg('bw.history_created', path=path))
+            self._map[:file_size] = b'\x00' * file_size
+            self._sequence = 0
+            self._write_header()
+        else:
+            self._sequence = header[3]
+            self.read_total, self.written_total = header[4], header[5]
+            self.last_update = header[6]
+            log.info(msg('bw.history_loaded', path=path, since=time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(self.last_update))))
+
+    @staticmethod
+    def _layout_checksum():
+        return zlib.crc32(repr((LEVELS, RECORD.format))) & 0xffffffff
+
+    def _read_header(self):
+        """
+        Provides the newest valid header of the file.
+
+        :returns: **tuple** with the header values, or **None** if neither
+          slot is valid.
+        """
+
+        newest = None
+
+        for slot in (0, 1):
+            position = slot * HEADER.size
+            header = HEADER.unpack_from(self._map, position)
+            content = self._map[position:position + HEADER.size - 4]
+
+            if header[0] != HEADER_MAGIC or header[1] != HEADER_VERSION:
+                continue
+            elif header[2] != self._layout_checksum():
+                continue
+            elif header[7] != zlib.crc32(content) & 0xffffffff:
+                continue
+            elif newest is None or header[3] > newest[3]:
+                newest = header
+
+        return newest
+
+    def _write_header(self):
+        """
+        Writes our totals to the oldest header slot.
+        """
+
+        self._sequence += 1
+        position = (self._sequence % 2) * HEADER.size
+        values = (
+            HEADER_MAGIC, HEADER_VERSION, self._layout_checksum(),
+            self._sequence, self.read_total, self.written_total,
+            self.last_update)
+
+        checksum = zlib.crc32(struct.pack(HEADER.format[:-1], *values))
+        HEADER.pack_into(
+            self._map, position, *(values + (checksum & 0xffffffff,)))
+
+    def add(self, timestamp, read, written):
+        BandwidthHistory.add(self, timestamp, read, written)
+        self._write_header()
+
+        if time.time() - self._last_sync >= CONFIG['bw.history.sync']:
+            self._map.flush()
+            self._last_sync = time.time()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
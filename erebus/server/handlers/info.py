@@ -11,11 +11,79 @@
 
 """
 Relay info functions, including fingerprint, nickname, tor version, etc.
+
+The relay's info rarely changes, so a snapshot of it is cached and every
+INFO request is served from memory. The snapshot is dropped when tor's
+configuration changes or we reconnect to tor.
+
+The relay's status (flags, weight, bandwidth, exit policy...) comes from
+our consensus entry and descriptor, so it's only rebuilt when tor receives
+a new consensus or a new descriptor of ours.
 """
 
-from stem.control import State
+import calendar
+
+import stem
+
+from stem.control import EventType, State
+from stem.util import conf
 
 from erebus.util import tor_controller
+from erebus.util.cache import QueryCache
+
+
+def conf_handler(key, value):
+    if key == 'info.cache.ttl':
+        return max(0, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'info.cache.ttl': 3600,
+}, conf_handler)
+
+# Made when we connect to tor, once our configuration has been loaded.
+RELAY_INFO = None
+
+
+def init_relay_info(controller):
+    """
+    Drops the relay info of any previous tor connection and keeps the
+    snapshot of this one up to date with CONF_CHANGED events.
+
+    :param Class controller: :class:`~stem.control.Controller` of the new
+      connection.
+    """
+
+    global RELAY_INFO
+
+    RELAY_INFO = QueryCache(CONFIG['info.cache.ttl'])
+    controller.add_event_listener(
+        lambda event: RELAY_INFO.invalidate(), EventType.CONF_CHANGED)
+
+
+def relay_info(controller):
+    """
+    Queries tor for a snapshot of the relay's info. Both GETINFO keys are
+    requested at once, and the nickname comes from stem's cache of our
+    configuration unless it was changed.
+
+    :param Class controller: :class:`~stem.control.Controller`
+
+    :returns: dictionary with relay information.
+    """
+
+    try:
+        values = controller.get_info(['fingerprint', 'version'])
+    except stem.ControllerError:
+        # Our fingerprint is unavailable if we aren't a relay, and that
+        # fails the whole query.
+        values = {'version': controller.get_info('version', 'Unknown')}
+
+    return {
+        'fingerprint': values.get('fingerprint', 'Unknown'),
+        'nickname': controller.get_conf('Nickname', ''),
+        'version': values.get('version', 'Unknown').split()[0],
+    }
 
 
 def get_info():
@@ -28,18 +96,77 @@ def get_info():
 
     controller = tor_controller()
     if controller is not None:
-        output = {
-            'fingerprint': controller.get_info('fingerprint', 'Unknown'),
-            'nickname': controller.get_conf('Nickname', ''),
-            'version': str(controller.get_version('Unknown')).split()[0],
-            'status': 'online'
-        }
+        # Our cache is only made once we're done connecting to tor.
+        if RELAY_INFO is not None:
+            output = dict(RELAY_INFO.get(
+                'relay', lambda: relay_info(controller)))
+        else:
+            output = relay_info(controller)
+
+        output['status'] = 'online'
     else:
         output = {'status': 'offline'}
 
     return output
 
 
+def affects_relay_status(event):
+    """
+    Checks if a tor event might have changed our relay status, that is, if
+    it's a new consensus or a new descriptor of ours.
+
+    :param Class event: :class:`~stem.response.events.Event`
+      delivered by stem.
+
+    :returns: **True** if the event affects our status, **False** otherwise
+    """
+
+    if event.type == EventType.NEWDESC:
+        fingerprint = get_info().get('fingerprint')
+        return fingerprint in [relay[0] for relay in event.relays]
+
+    return event.type == EventType.NEWCONSENSUS
+
+
+def get_relay_status():
+    """
+    Get relay status, from our entry in the consensus and our server
+    descriptor. Either might be unavailable (for instance, if we aren't
+    a relay or aren't in the consensus yet), in which case its attributes
+    are omitted.
+
+    :returns: dictionary with relay status, or **None** if tor is down.
+    """
+
+    controller = tor_controller()
+    if controller is None:
+        return None
+
+    output = {'header': 'RELAY-STATUS'}
+
+    router_status = controller.get_network_status(default=None)
+    if router_status is not None:
+        output['flags'] = sorted(router_status.flags)
+        output['consensus_weight'] = router_status.bandwidth
+        output['unmeasured'] = router_status.is_unmeasured
+
+    server_desc = controller.get_server_descriptor(default=None)
+    if server_desc is not None:
+        # Tor advertises the lowest of our rate, burst and observed
+        # bandwidth (see dir-spec's bandwidth line).
+        output['advertised'] = min(
+            server_desc.average_bandwidth, server_desc.burst_bandwidth,
+            server_desc.observed_bandwidth)
+        output['observed'] = server_desc.observed_bandwidth
+        output['uptime'] = server_desc.uptime
+        output['published'] = calendar.timegm(
+            server_desc.published.utctimetuple())
+        output['exit_policy'] = server_desc.exit_policy.summary()
+        output['family'] = sorted(server_desc.family)
+
+    return output
+
+
 def get_status(state):
     """
     Just return the current state of tor control connection.
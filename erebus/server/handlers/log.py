@@ -14,15 +14,23 @@ Log handler for both erebus and tor. This will notify the client of
 erebus events and tor events (if tor is up). It also supports prepopulation.
 """
 
-import datetime
+import calendar
+import collections
+import functools
+import itertools
+import re
 import stem
 import time
 import threading
 
 from stem.response import events
-from stem.util import conf, log, system
+from stem.util import conf, log
 
+from erebus.server.handlers.archive import log_archive
+from erebus.server.handlers.search import matches, parse_query
 from erebus.util import msg, tor_controller
+from erebus.util.files import FileFollower, reverse_lines
+from erebus.util.ratelimit import RateLimiter
 
 try:
     # added in python 3.2
@@ -30,17 +38,43 @@ try:
 except ImportError:
     from stem.util.lru_cache import lru_cache
 
+try:
+    # moved to sys in python 3
+    from sys import intern
+except ImportError:
+    pass
+
 
 def conf_handler(key, value):
     if key == 'log.populate.limit':
         return max(0, value)
     elif key == 'log.cache.size':
         return max(0, value)
+    elif key == 'log.follow.interval':
+        return max(0.1, value)
+    elif key == 'log.search.limit':
+        return max(1, value)
+    elif key in ('log.dedup.window', 'log.dedup.size'):
+        return max(0, value)
+    elif key in ('log.page.size', 'log.page.maxSize', 'log.rate.top'):
+        return max(1, value)
+    elif key == 'log.rate.burst':
+        return max(0.0, value)
 
 
 CONFIG = conf.config_dict('erebus', {
     'log.populate.limit': 100,
     'log.cache.size': 100,
+    'log.follow': True,
+    'log.follow.interval': 1.0,
+    'log.search.limit': 500,
+    'log.dedup.window': 60,
+    'log.dedup.size': 10000,
+    'log.page.size': 50,
+    'log.page.maxSize': 500,
+    'log.rate.limit': {},
+    'log.rate.burst': 2.0,
+    'log.rate.top': 5,
     'tor.chroot': '',
 }, conf_handler)
 
@@ -74,6 +108,32 @@ TOR_EVENT_TYPES = {
     'v': 'STATUS_SERVER',
 }
 
+# Parts of messages that vary between otherwise repeated messages: addresses
+# (IPv6 with brackets or at least two colons, IPv4 with an optional port),
+# relay fingerprints and the ids of circuits, streams, connections and
+# sockets. Other numbers are usually what the message is about (like
+# bootstrap progress), so they're kept.
+VARYING_CONTENT = re.compile(
+    r'\[[0-9a-fA-F:.]+\](?::\d+)?|'
+    r'(?:[0-9a-fA-F]{0,4}:){2,}[0-9a-fA-F.]*|'
+    r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b|'
+    r'\$?\b[0-9a-fA-F]{40}\b|'
+    r'(?P<id>\b(?:circ(?:uit)?|stream|conn(?:ection)?|socket|fd|id)'
+    r'(?: |=| #| ID )?)\d+\b', re.IGNORECASE)
+
+# Events whose content starts with the id of what they're about.
+LEADING_ID = re.compile(r'^\d+\b')
+LEADING_ID_EVENTS = ('CIRC', 'CIRC_MINOR', 'STREAM')
+
+# Events whose numbers are all they're about, so they're only repeats if
+# they're identical.
+EXACT_EVENTS = ('BW', 'STREAM_BW', 'CIRC_BW', 'CONN_BW', 'BUILDTIMEOUT_SET',
+                'CLIENTS_SEEN')
+
+MONTHS = dict([(month, index + 1) for index, month in enumerate((
+    'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+    'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))])
+
 LOG_HANDLER = None
 
 
@@ -123,6 +183,25 @@ class LogHandler():
         # Log cache.
         self._event_log = LogGroup(CONFIG['log.cache.size'])
 
+        # Recent entries by their normalized message, as (type, message) =>
+        # (sequence number, when last seen). Repeats within
+        # `log.dedup.window` seconds are counted rather than added.
+        self._recent = collections.OrderedDict()
+        self._counts = {}
+        self._repeats = {}
+
+        # Positions of the entries of our cache in the log archive, by their
+        # sequence number. Prepopulated entries aren't archived.
+        self._positions = {}
+
+        # Budgets of event types, in events per second (`log.rate.limit`).
+        # Events over budget are only counted, and summarized periodically.
+        self._rate_limiter = RateLimiter(
+            CONFIG['log.rate.limit'], CONFIG['log.rate.burst'])
+
+        # Follows tor's log file, for the runlevels it has.
+        self._follower = None
+
         self._init_erebus_log(listener)
 
     def _get_erebus_events(self, events):
@@ -178,14 +257,33 @@ class LogHandler():
         :returns: dictionary with log entry information.
         """
 
-        msg_str = ' '.join(str(event).split(' ')[1:])
-        if isinstance(event, events.BandwidthEvent):
-            msg_str = 'READ: %i, WRITTEN: %i' % (event.read, event.written)
-        elif isinstance(event, events.LogEvent):
-            msg_str = event.message
+        # Events over budget are counted before spending time on them.
+        if not self._rate_limiter.allow(event.type):
+            if event.type in self._logged_events:
+                self._rate_limiter.suppress(event.type, summary_key(event))
+            return
+
+        formatter = EVENT_FORMATTERS.get(event.type, event_content)
 
         # Pass a valid log entry to _event function
-        return self._event(LogEntry(event.arrived_at, event.type, msg_str))
+        return self._event(
+            LogEntry(event.arrived_at, event.type, formatter(event)))
+
+    def _tor_file_event(self, entry):
+        """
+        Receives an entry read from tor's log file and returns a log entry
+        ready to be sent to the client.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+        :returns: dictionary with log entry information.
+        """
+
+        if not self._rate_limiter.allow(entry.type):
+            self._rate_limiter.suppress(
+                entry.type, message_key(entry.message))
+            return
+
+        return self._event(entry)
 
     def _erebus_event(self, record):
         """
@@ -215,16 +313,117 @@ class LogHandler():
         if entry.type not in self._logged_events:
             return
 
-        # Save log entry in our cache.
-        self._event_log.add(entry)
+        # Every entry is archived, including repeats.
+        archive = log_archive()
+        position = archive.add(entry) if archive is not None else None
+
+        if self._repeated(entry):
+            return
 
         return {
             'header': 'LOG-ENTRY',
+            'id': self._add(entry, position),
             'time': entry.readable_time,
-            'type': entry.type.lower(),
+            'type': type_label(entry.type),
             'message': entry.message
         }
 
+    def _add(self, entry, position=None):
+        """
+        Adds an entry to our cache, and starts tracking its repeats.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+        :param int position: position of the entry in the log archive, if
+          it's archived.
+
+        :returns: **int** with the sequence number of the entry.
+        """
+
+        seq = self._event_log.add(entry)
+        self._counts.pop(seq - CONFIG['log.cache.size'], None)
+        self._positions.pop(seq - CONFIG['log.cache.size'], None)
+
+        if position is not None:
+            self._positions[seq] = position
+
+        if CONFIG['log.dedup.window']:
+            key = (entry.type, normalize_message(entry.message, entry.type))
+            self._recent.pop(key, None)
+            self._recent[key] = (seq, time.time())
+
+            if len(self._recent) > CONFIG['log.dedup.size']:
+                self._recent.popitem(last=False)
+
+        return seq
+
+    def _repeated(self, entry):
+        """
+        Checks if an entry repeats a recent one (with only numbers or
+        addresses differing). If so, the count of the earlier entry is
+        increased rather than adding this one.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+
+        :returns: **True** if the entry is a repeat, **False** otherwise
+        """
+
+        if not CONFIG['log.dedup.window']:
+            return False
+
+        now = time.time()
+
+        # Entries are ordered by when they were last seen, so the expired
+        # ones are at the front.
+        while self._recent:
+            key = next(iter(self._recent))
+            if now - self._recent[key][1] <= CONFIG['log.dedup.window']:
+                break
+            del self._recent[key]
+
+        key = (entry.type, normalize_message(entry.message, entry.type))
+        recent = self._recent.pop(key, None)
+
+        # Repeats of entries that left our cache are added again, so clients
+        # have something to count them against.
+        if recent is None or recent[0] < self._event_log.first_seq():
+            return False
+
+        seq = recent[0]
+        self._recent[key] = (seq, now)
+        self._counts[seq] = self._counts.get(seq, 1) + 1
+        self._repeats[seq] = {
+            'id': seq,
+            'count': self._counts[seq],
+            'time': entry.readable_time,
+        }
+
+        return True
+
+    def has_repeats(self):
+        """
+        Checks if there are repeats that haven't been provided yet by
+        :func:`~erebus.server.handlers.log.LogHandler.get_repeats`.
+
+        :returns: **True** if there are pending repeats, **False** otherwise
+        """
+
+        return bool(self._repeats)
+
+    def get_repeats(self):
+        """
+        Provides the entries repeated since this was last called, with the
+        number of times each has been seen.
+
+        :returns: dictionary with the repeated entries.
+        """
+
+        repeats, self._repeats = self._repeats, {}
+
+        return {
+            'header': 'LOG-REPEAT',
+            'repeats': sorted(repeats.values(), key=lambda r: r['id']),
+        }
+
     def _init_erebus_log(self, listener):
         """
         Initializes erebus log by adding a listener to be notified of logged
@@ -242,17 +441,30 @@ class LogHandler():
                 listener(event)
         erebus_log.emit = listener
 
-    def init_tor_log(self, listener):
+    def init_tor_log(self, listener, file_listener=None):
         """
         Initializes tor log by adding a  listener to be notified of logged
         tor events. In addition, prepopulates the log cache.
 
+        If `log.follow` is set and tor writes a log file we can read, the
+        runlevels that file has are read from it instead, so tor doesn't
+        need to send them over the control connection.
+
         :param function listener: listener to be notified.
+        :param function file_listener: listener to be notified, from the
+          reactor thread, of each
+          :class:`~erebus.server.handlers.log.LogEntry` read from tor's log
+          file.
         """
 
         controller = tor_controller()
         controller.remove_event_listener(listener)
+        followed = self._follow_tor_log(file_listener)
+
         for event_type in self._tor_events:
+            if event_type in followed:
+                continue
+
             try:
                 controller.add_event_listener(listener, event_type)
             except stem.ProtocolError:
@@ -261,6 +473,67 @@ class LogHandler():
         # Populates the log cache from tor log file.
         self._prepopulate()
 
+    def _follow_tor_log(self, listener):
+        """
+        Starts following tor's log file, if there's one with runlevels we're
+        listening for.
+
+        :param function listener: listener to be notified of log entries.
+
+        :returns: **set** of the runlevels read from the file.
+        """
+
+        if self._follower is not None:
+            self._follower.stop()
+            self._follower = None
+
+        if not CONFIG['log.follow'] or listener is None:
+            return set()
+
+        path, runlevels = log_file()
+        runlevels = set(runlevels).intersection(self._tor_events)
+
+        if not path or not runlevels:
+            return set()
+
+        follower = FileFollower(
+            path, functools.partial(self._tor_log_lines, path, runlevels,
+                                    listener),
+            CONFIG['log.follow.interval'])
+
+        try:
+            uses_inotify = follower.start()
+        except IOError as exc:
+            log.info(msg('log.unable_to_follow', path=path, error=exc))
+            return set()
+
+        log.info(msg(
+            'log.following', path=path,
+            runlevels=', '.join(r for r in TOR_RUNLEVELS if r in runlevels),
+            method='inotify' if uses_inotify else 'polling'))
+
+        self._follower = follower
+        return runlevels
+
+    def _tor_log_lines(self, path, runlevels, listener, lines):
+        """
+        Parses lines appended to tor's log file, and notifies our listener
+        of the ones we're following.
+        """
+
+        # The year is guessed from the present, so this needs to be fresh.
+        parser = TimestampParser()
+
+        for line in lines:
+            try:
+                entry = parse_tor_log_line(line, path, parser)
+            except ValueError as exc:
+                log.debug(str(exc))
+                continue
+
+            if entry.type in runlevels:
+                listener(entry)
+
     def _prepopulate(self):
         """
         Populates our log cache if tor log file is available. The population
@@ -282,6 +555,40 @@ class LogHandler():
             except ValueError as exc:
                 log.info(str(exc))
 
+    def has_summaries(self):
+        """
+        Checks if events went over their budget since
+        :func:`~erebus.server.handlers.log.LogHandler.get_summary` was last
+        called.
+
+        :returns: **True** if events were over budget, **False** otherwise
+        """
+
+        return self._rate_limiter.has_suppressed()
+
+    def get_summary(self):
+        """
+        Summarizes the events over their budget since this was last called,
+        with how many there were of each type and the most common ones.
+
+        :returns: dictionary with the summaries of suppressed events.
+        """
+
+        output = {
+            'header': 'LOG-SUMMARY',
+            'time': readable_time(time.time()),
+            'summaries': []
+        }
+        for event_type, count, top in self._rate_limiter.summarize(
+                CONFIG['log.rate.top']):
+            output['summaries'].append({
+                'type': event_type.lower(),
+                'count': count,
+                'top': [{'message': key, 'count': key_count}
+                        for key, key_count in top],
+            })
+        return output
+
     def get_cache(self):
         """
         Returns the current log cache we have in memory.
@@ -293,44 +600,286 @@ class LogHandler():
             'header': 'LOG-CACHE',
             'entries': []
         }
-        for entry in list(self._event_log):
-            output['entries'].insert(0, {
-                'time': entry.readable_time,
-                'type': entry.type.lower(),
-                'message': entry.message,
-            })
+        for seq, entry in self._event_log.items():
+            output['entries'].append(self._page_entry(entry, seq))
+        return output
+
+    def get_page(self, cursor=None, size=None, types=None):
+        """
+        Provides a page of log entries, from newest to oldest. Pages are
+        served from our log cache, continuing from the log archive (if we
+        have one) once the cache has no older entries. Entries from the
+        archive have no id, and repeats in it aren't collapsed.
+
+        Cursors are opaque to clients, who get the cursor of the next page
+        with each one. They're either 'seq:<id>:[<position>]' (entries of
+        our cache older than the one with that id, and then archived
+        entries before that position) or 'archive:<position>' (archived
+        entries before that position). Positions are those of the archive,
+        so the entries our cache had are never provided again, even once
+        they've left our cache.
+
+        :param str cursor: where the page starts, or the newest entry if not
+          provided.
+        :param int size: maximum number of entries to provide, capped to
+          `log.page.maxSize`.
+        :param list types: event types to provide, or all of them if not
+          provided.
+
+        :returns: dictionary with the page's log entries.
+
+        :raises: **ValueError** if the cursor is malformed
+        """
+
+        size = min(size or CONFIG['log.page.size'], CONFIG['log.page.maxSize'])
+        types = set(event_type.upper() for event_type in types or [])
+        kind, seq, position = parse_cursor(cursor)
+
+        entries, next_cursor = [], None
+
+        if kind != 'archive':
+            for entry_seq, entry in reversed(self._event_log.items()):
+                if seq is not None and entry_seq >= seq:
+                    continue
+
+                # Older archived entries are the ones before the oldest
+                # entry of ours we've gone through.
+                position = self._positions.get(entry_seq, position)
+
+                if types and entry.type not in types:
+                    continue
+
+                entries.append(self._page_entry(entry, entry_seq))
+
+                if len(entries) == size:
+                    next_cursor = 'seq:%i:%s' % (
+                        entry_seq, '' if position is None else position)
+                    break
+
+        archive = log_archive()
+
+        if next_cursor is None and archive is not None:
+            older = archive.page(size - len(entries), position, types)
+
+            for _, (timestamp, event_type, message) in older:
+                entries.append(self._page_entry(
+                    LogEntry(timestamp, event_type, message)))
+
+            if older and len(entries) == size:
+                next_cursor = 'archive:%i' % older[-1][0]
+
+        return {
+            'header': 'LOG-PAGE',
+            'cursor': cursor,
+            'next': next_cursor,
+            'entries': entries,
+        }
+
+    def cached_entries(self):
+        """
+        Provides the entries of our log cache.
+
+        :returns: **list** of (seq, entry) tuples, from oldest to newest
+        """
+
+        return self._event_log.items()
+
+    def _page_entry(self, entry, seq=None):
+        """
+        Provides a log entry of our cache or archive as sent to clients.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+        :param int seq: sequence number of the entry in our cache, if it's
+          there.
+
+        :returns: dictionary with the log entry.
+        """
+
+        output = {
+            'time': entry.readable_time,
+            'type': entry.type.lower(),
+            'message': entry.message,
+        }
+
+        if seq is not None:
+            output['id'] = seq
+            output['count'] = self._counts.get(seq, 0)
+
         return output
 
 
+def parse_cursor(cursor):
+    """
+    Parses the cursor of a log page, as described by
+    :func:`~erebus.server.handlers.log.LogHandler.get_page`.
+
+    :param str cursor: cursor to be parsed.
+
+    :returns: **tuple** of the form (kind, seq, position), with the kind of
+      cursor ('seq', 'archive' or **None** if there's no cursor), the
+      sequence number of our cache it points to and its position in the log
+      archive (either might be **None**)
+
+    :raises: **ValueError** if the cursor is malformed
+    """
+
+    if not cursor:
+        return None, None, None
+
+    comp = cursor.split(':')
+
+    if comp[0] == 'seq' and len(comp) in (2, 3):
+        position = int(comp[2]) if len(comp) == 3 and comp[2] else None
+        return 'seq', int(comp[1]), position
+    elif comp[0] == 'archive' and len(comp) == 2:
+        return 'archive', None, int(comp[1])
+
+    raise ValueError('malformed log cursor: %s' % cursor)
+
+
+def search_logs(query, start=None, end=None, types=None, limit=None):
+    """
+    Provides the newest log entries matching a query, from the log archive
+    (or our log cache, if we aren't archiving logs). Queries are words and
+    quoted phrases the messages must have, like '"clock skew" guard'.
+
+    :param str query: words and phrases to search for.
+    :param int start: unix timestamp where the range starts, or the
+      beginning of our logs if not provided.
+    :param int end: unix timestamp where the range ends, or now if not
+      provided.
+    :param list types: event types to provide, or all of them if not
+      provided.
+    :param int limit: maximum number of entries to provide, capped to
+      `log.search.limit`.
+
+    :returns: dictionary with the matching log entries, newest first.
+    """
+
+    phrases = parse_query(query)
+    types = set(event_type.upper() for event_type in types or [])
+    limit = min(limit or CONFIG['log.search.limit'],
+                CONFIG['log.search.limit'])
+
+    archive = log_archive()
+    if archive is not None:
+        entries, truncated = archive.search(
+            phrases, start, end, types, limit)
+    else:
+        entries = []
+        if LOG_HANDLER is not None:
+            for _, entry in reversed(LOG_HANDLER.cached_entries()):
+                if (start is None or entry.timestamp >= start) and \
+                        (end is None or entry.timestamp <= end) and \
+                        (not types or entry.type in types) and \
+                        matches(phrases, entry.message):
+                    entries.append(
+                        (entry.timestamp, entry.type, entry.message))
+
+        truncated = len(entries) > limit
+        entries = entries[:limit]
+
+    output = {
+        'header': 'LOG-SEARCH',
+        'query': query,
+        'from': start,
+        'to': end,
+        'truncated': truncated,
+        'entries': []
+    }
+    for timestamp, event_type, message in entries:
+        output['entries'].append({
+            'timestamp': timestamp,
+            'time': readable_time(timestamp),
+            'type': event_type.lower(),
+            'message': message,
+        })
+    return output
+
+
 class LogGroup(object):
     """
     Thread safe collection of LogEntry instances, which maintains a
     certain size. This is our local log cache.
+
+    Entries are kept in a ring buffer, so adding one (and evicting the
+    oldest when full) takes constant time. Each entry gets a sequence
+    number, counting every entry ever added.
     """
 
     def __init__(self, max_size):
         self._max_size = max_size
-        self._entries = []
-        self._lock = threading.RLock()
+        self._entries = [None] * max_size
+        self._next_seq = 0
+        self._lock = threading.Lock()
 
     def add(self, entry):
+        """
+        Adds an entry, evicting the oldest one if we're full.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+
+        :returns: **int** with the sequence number of the entry.
+        """
+
         with self._lock:
-            self._entries.insert(0, entry)
-            while len(self._entries) > self._max_size:
-                self.pop()
+            seq = self._next_seq
+            if self._max_size:
+                self._entries[seq % self._max_size] = entry
+            self._next_seq += 1
+            return seq
+
+    def snapshot(self):
+        """
+        Provides a copy of our entries, from oldest to newest. Only the copy
+        is made while holding our lock, so callers can serialize entries
+        without blocking writers.
+
+        :returns: **list** of :class:`~erebus.server.handlers.log.LogEntry`
+        """
 
-    def pop(self):
         with self._lock:
-            self._entries.pop()
+            return self._ordered()
+
+    def items(self):
+        """
+        Provides a copy of our entries with their sequence numbers, from
+        oldest to newest.
+
+        :returns: **list** of (seq, entry) tuples
+        """
+
+        with self._lock:
+            entries = self._ordered()
+            first_seq = self._next_seq - len(entries)
+
+        return list(zip(itertools.count(first_seq), entries))
+
+    def _ordered(self):
+        if self._next_seq <= self._max_size or not self._max_size:
+            return self._entries[:self._next_seq]
+
+        head = self._next_seq % self._max_size
+        return self._entries[head:] + self._entries[:head]
+
+    def first_seq(self):
+        """
+        Provides the sequence number of our oldest entry.
+
+        :returns: **int** with the sequence number of our oldest entry, or
+          the next one to be added if we're empty
+        """
+
+        with self._lock:
+            return max(0, self._next_seq - self._max_size)
 
     def __len__(self):
         with self._lock:
-            return len(self._entries)
+            return min(self._next_seq, self._max_size)
 
     def __iter__(self):
-        with self._lock:
-            for entry in self._entries:
-                yield entry
+        # Newest entries first.
+        return reversed(self.snapshot())
 
 
 class LogEntry(object):
@@ -340,21 +889,26 @@ class LogEntry(object):
     **Note:** Tor doesn't include the date in its timestamps so the year
     component may be inaccurate. (:trac:`15607`)
 
+    Caches can hold many thousands of entries, so they're kept compact: they
+    have no **__dict__**, their type and message are interned (repeated ones
+    are shared) and their readable time is only made when asked for.
+
     :var int timestamp: unix timestamp for when the event occured
     :var str readable_time: human readable time of the log entry
     :var str type: event type
     :var str message: event's message
     """
 
+    __slots__ = ('timestamp', 'type', 'message')
+
     def __init__(self, timestamp, type, message):
         self.timestamp = timestamp
-        self.type = type
-        self.message = message
+        self.type = intern_str(type)
+        self.message = intern_str(message)
 
-        # Make a readable time description from the timestamp.
-        entry_time = time.localtime(self.timestamp)
-        self.readable_time = '%02i:%02i:%02i' % (
-            entry_time[3], entry_time[4], entry_time[5])
+    @property
+    def readable_time(self):
+        return readable_time(self.timestamp)
 
     def __eq__(self, other):
         if isinstance(other, LogEntry):
@@ -363,7 +917,172 @@ class LogEntry(object):
             return False
 
     def __hash__(self):
-        return hash(self.display_message)
+        return hash((self.type, self.message))
+
+
+def event_content(event):
+    """
+    Provides the content of a tor event following its type. For example, the
+    message of a 'CIRC 7 BUILT ...' event is '7 BUILT ...'.
+
+    :param Class event: a valid :class:`~stem.response.` subclass.
+
+    :returns: **str** with the event's content
+    """
+
+    # Stem has already rendered most events to parse them, and caches it.
+    return str(event)[len(event.type) + 1:]
+
+
+def log_event_message(event):
+    """
+    Provides the message of a tor runlevel event (DEBUG, INFO, etc).
+
+    :param Class event: :class:`~stem.response.events.LogEvent`
+
+    :returns: **str** with the logged message
+    """
+
+    return event.message
+
+
+def bw_event_message(event):
+    """
+    Provides a description of the traffic of a BW event.
+
+    :param Class event: :class:`~stem.response.events.BandwidthEvent`
+
+    :returns: **str** with the bytes read and written
+    """
+
+    return 'READ: %i, WRITTEN: %i' % (event.read, event.written)
+
+
+# Formatters of tor events with their own message. Other events, including
+# the high volume CIRC, STREAM, ORCONN and STREAM_BW ones, are formatted by
+# event_content(): stem renders and caches their text while parsing them, so
+# slicing it is cheaper than formatting their parsed fields, and keeps tor's
+# wording (and keywords stem doesn't parse).
+EVENT_FORMATTERS = dict(
+    [(runlevel, log_event_message) for runlevel in TOR_RUNLEVELS] +
+    [('BW', bw_event_message)])
+
+TYPE_LABELS = {}
+
+
+def type_label(event_type):
+    """
+    Provides the lowercase label of an event type we send to clients.
+
+    :param str event_type: event type.
+
+    :returns: **str** with the event type lowercased
+    """
+
+    label = TYPE_LABELS.get(event_type)
+
+    if label is None:
+        label = TYPE_LABELS[event_type] = event_type.lower()
+
+    return label
+
+
+def intern_str(value):
+    """
+    Interns a string, so equal ones share their memory. Python 2 can only
+    intern byte strings, others are provided as-is.
+
+    :param str value: string to intern.
+
+    :returns: **str** that's equal to the value
+    """
+
+    return intern(value) if type(value) is str else value
+
+
+# Second and readable time we last formatted. Entries mostly come in order,
+# so consecutive ones usually share their second.
+LAST_READABLE_TIME = (None, None)
+
+
+def readable_time(timestamp):
+    """
+    Provides the local time of day of a unix timestamp, like '18:29:48'.
+
+    :param float timestamp: unix timestamp.
+
+    :returns: **str** with the time of day
+    """
+
+    global LAST_READABLE_TIME
+
+    second = int(timestamp)
+    last_second, last_time = LAST_READABLE_TIME
+
+    if second != last_second:
+        entry_time = time.localtime(second)
+        last_time = '%02i:%02i:%02i' % (
+            entry_time[3], entry_time[4], entry_time[5])
+        LAST_READABLE_TIME = (second, last_time)
+
+    return last_time
+
+
+def summary_key(event):
+    """
+    Provides a cheap description of what a tor event is about, for
+    summarizing events over their budget. This is the start of log messages,
+    the status of events that have one (like CIRC or STREAM events) and the
+    type for others.
+
+    :param Class event: a valid :class:`~stem.response.` subclass.
+
+    :returns: **str** describing the event
+    """
+
+    if isinstance(event, events.LogEvent):
+        return message_key(event.message)
+
+    return getattr(event, 'status', None) or event.type
+
+
+def message_key(message):
+    """
+    Provides the first two words of a message, which for tor's log messages
+    is usually the function logging it and what it's about.
+
+    :param str message: message to describe.
+
+    :returns: **str** with the start of the message
+    """
+
+    return ' '.join(message.split(' ', 2)[:2])
+
+
+def normalize_message(message, event_type=None):
+    """
+    Masks the parts of a message that vary between repeats of it, like
+    addresses and circuit ids. For example...
+
+    >>> normalize_message('Received 3 cells on circuit 17 from 10.0.0.1:9001')
+    'Received 3 cells on circuit # from #'
+
+    :param str message: message to be normalized
+    :param str event_type: type of the message's event, if known
+
+    :returns: **str** with the message's addresses and ids masked
+    """
+
+    if event_type in EXACT_EVENTS:
+        return message
+    elif event_type in LEADING_ID_EVENTS:
+        message = LEADING_ID.sub('#', message)
+
+    return VARYING_CONTENT.sub(_mask_varying, message)
+
+
+def _mask_varying(match):
+    return (match.group('id') or '') + '#'
 
 
 def log_file_path():
@@ -373,13 +1092,65 @@ def log_file_path():
     :returns: **str** with the absolute path of tor log file, or **None**
     if one doesn't exist
     """
+
+    return log_file()[0]
+
+
+def log_file():
+    """
+    Provides the path where tor's log file resides and the runlevels it has.
+
+    :returns: **tuple** of the form (path, runlevels) with the absolute path
+      of tor's log file and the **list** of runlevels written to it, or
+      (**None**, []) if there isn't one
+    """
+
     controller = tor_controller()
     for log_entry in controller.get_conf('Log', [], True):
         entry_comp = log_entry.split()
         # looking for an entry like:
         # notice file /var/log/tor/notices.log
-        if entry_comp[1] == 'file':
-            return CONFIG['tor.chroot'] + entry_comp[2]
+        if len(entry_comp) >= 3 and entry_comp[1] == 'file':
+            path = CONFIG['tor.chroot'] + entry_comp[2]
+            return path, log_file_runlevels(entry_comp[0])
+
+    return None, []
+
+
+def log_file_runlevels(severity):
+    """
+    Provides the runlevels logged for a severity of tor's Log option. For
+    example...
+
+    >>> log_file_runlevels('notice')
+    ['NOTICE', 'WARN', 'ERR']
+
+    >>> log_file_runlevels('debug-info')
+    ['DEBUG', 'INFO']
+
+    Severities restricted to certain domains (like '[~net]info') only log
+    some of a runlevel's messages, so they provide no runlevels.
+
+    :param str severity: severity, as in tor's Log option
+
+    :returns: **list** of the runlevels logged
+    """
+
+    if '[' in severity:
+        return []
+
+    if '-' in severity:
+        min_level, max_level = severity.upper().split('-', 1)
+    else:
+        min_level, max_level = severity.upper(), 'ERR'
+
+    if min_level not in TOR_RUNLEVELS or max_level not in TOR_RUNLEVELS:
+        return []
+
+    start, end = TOR_RUNLEVELS.index(min_level), \
+        TOR_RUNLEVELS.index(max_level)
+
+    return TOR_RUNLEVELS[start:end + 1]
 
 
 def read_tor_log(path, read_limit=None):
@@ -397,59 +1168,139 @@ def read_tor_log(path, read_limit=None):
     """
 
     start_time = time.time()
-    count, isdst = 0, time.localtime().tm_isdst
+    count, parser = 0, TimestampParser()
 
-    for line in system.tail(path, read_limit):
-        # entries look like:
-        # Jul 15 18:29:48.806 [notice] Parsing GEOIP file.
+    for line in itertools.islice(reverse_lines(path), read_limit):
+        entry = parse_tor_log_line(line, path, parser)
 
-        line_comp = line.split()
+        count += 1
+        yield entry
 
-        # Checks that we have all the components we expect. This could
-        # happen if we're either not parsing a tor log or in weird edge
-        # cases (like being out of disk space).
+        if 'opening log file' in entry.message:
+            break  # this entry marks the start of this tor instance
 
-        if len(line_comp) < 4:
-            raise ValueError(msg('log.bad_format', path=path, line=line))
-        elif line_comp[3][1:-1].upper() not in TOR_RUNLEVELS:
-            raise ValueError(msg(
-                'log.unknown_runlevel', path=path, runlevel=line_comp[3]))
+    log.info(msg(
+        'log.read_from_log_file', count=count, path=path,
+        read_limit=read_limit, runtime='%0.3f' % (time.time() - start_time)))
+
+
+def parse_tor_log_line(line, path, parser):
+    """
+    Parses a line of tor's log file.
+
+    :param str line: line to be parsed, without its line ending.
+    :param str path: location of the log, for error messages.
+    :param TimestampParser parser: parser for the line's timestamp.
+
+    :returns: :class:`~erebus.server.handlers.log.LogEntry` for the line
+
+    :raises: **ValueError** if the line has unrecognized content
+    """
+
+    # entries look like:
+    # Jul 15 18:29:48.806 [notice] Parsing GEOIP file.
+
+    line_comp = line.split()
+
+    # Checks that we have all the components we expect. This could
+    # happen if we're either not parsing a tor log or in weird edge
+    # cases (like being out of disk space).
 
-        runlevel = line_comp[3][1:-1].upper()
-        msg_str = ' '.join(line_comp[4:])
-        current_year = str(datetime.datetime.now().year)
+    if len(line_comp) < 4:
+        raise ValueError(msg('log.bad_format', path=path, line=line))
 
-        # Pretending it's the current year. We don't know the actual
-        # year (#15607) and this may fail due to leap years when picking
-        # Feb 29th (#5265).
+    runlevel = line_comp[3][1:-1].upper()
+    if runlevel not in TOR_RUNLEVELS:
+        raise ValueError(msg(
+            'log.unknown_runlevel', path=path, runlevel=line_comp[3]))
+
+    msg_str = ' '.join(line_comp[4:])
+
+    try:
+        timestamp = parser.parse(*line_comp[:3])
+    except ValueError:
+        raise ValueError(msg(
+            'log.bad_timestamp', path=path, value=' '.join(line_comp[:3])))
+
+    return LogEntry(timestamp, runlevel, msg_str)
+
+
+class TimestampParser(object):
+    """
+    Converts the timestamps of tor's log (like 'Jul 15 18:29:48.806') to
+    unix timestamps. The local epoch of each day's midnight is cached, so
+    most lines only cost some integer arithmetic.
+
+    Tor doesn't include the year in its timestamps (:trac:`15607`), so we
+    pretend it's the current one, unless that would put the entry in the
+    future (in which case it's from before a year boundary).
+    """
+
+    def __init__(self, now=None):
+        """
+        :param float now: unix timestamp of the present, defaults to now.
+        """
+
+        self._now = time.time() if now is None else now
+        self._year = time.localtime(self._now).tm_year
+        self._isdst = time.localtime().tm_isdst
+        self._midnights = {}
+
+    def _midnight(self, year, month, day):
+        key = (year, month, day)
+        midnight = self._midnights.get(key)
+
+        if midnight is None:
+            # Like strptime we reject days the month doesn't have this year,
+            # which mktime would roll over into the next month.
+            if year == self._year and \
+                    day > calendar.monthrange(year, month)[1]:
+                raise ValueError('day is out of range for month')
+
+            midnight = int(time.mktime(
+                (year, month, day, 0, 0, 0, 0, 0, self._isdst)))
+            self._midnights[key] = midnight
+
+        return midnight
+
+    def parse(self, month, day, clock):
+        """
+        Provides the unix timestamp of a log entry.
+
+        :param str month: abbreviated month name (like 'Jul').
+        :param str day: day of the month.
+        :param str clock: time of the day, with optional fractional seconds
+          (like '18:29:48.806').
+
+        :returns: **int** unix timestamp of the entry.
+
+        :raises: **ValueError** if the timestamp is malformed.
+        """
 
         try:
-            timestamp_str = current_year + ' ' + ' '.join(line_comp[:3])
-            # drop fractional seconds
-            timestamp_str = timestamp_str.split('.', 1)[0]
-            timestamp_comp = list(time.strptime(
-                timestamp_str, '%Y %b %d %H:%M:%S'))
-            timestamp_comp[8] = isdst
-            # converts local to unix time
-            timestamp = int(time.mktime(tuple(timestamp_comp)))
-
-            if timestamp > time.time():
-                # log entry is from before a year boundary
-                timestamp_comp[0] -= 1
-                timestamp = int(time.mktime(timestamp_comp))
-        except ValueError:
-            raise ValueError(msg(
-                'log.bad_timestamp', path=path, value=' '.join(line_comp[:3])))
+            month = MONTHS[month]
+        except KeyError:
+            raise ValueError('unrecognized month: %s' % month)
 
-        count += 1
-        yield LogEntry(timestamp, runlevel, msg_str)
+        day = int(day)
+        if clock[2:3] != ':' or clock[5:6] != ':':
+            raise ValueError('malformed time: %s' % clock)
 
-        if 'opening log file' in msg_str:
-            break  # this entry marks the start of this tor instance
+        hours, minutes, seconds = int(clock[:2]), int(clock[3:5]), \
+            int(clock[6:8])
 
-    log.info(msg(
-        'log.read_from_log_file', count=count, path=path,
-        read_limit=read_limit, runtime='%0.3f' % (time.time() - start_time)))
+        if not 1 <= day <= 31 or hours > 23 or minutes > 59 or \
+                seconds > 61 or min(hours, minutes, seconds) < 0:
+            raise ValueError('timestamp out of range: %s' % clock)
+
+        offset = hours * 3600 + minutes * 60 + seconds
+        timestamp = self._midnight(self._year, month, day) + offset
+
+        if timestamp > self._now:
+            # log entry is from before a year boundary
+            timestamp = self._midnight(self._year - 1, month, day) + offset
+
+        return timestamp
 
 
 @lru_cache()
@@ -0,0 +1,223 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Full-text search of log entries. Queries are made of words and quoted
+phrases, all of which need to be in an entry's message for it to match
+(case insensitive, matching whole words).
+
+The index is inverted at the granularity of archive blocks: each word maps
+to a bitmap of the blocks having it, so a query's candidate blocks are the
+intersection of its words' bitmaps, and only those are read and checked.
+Only words made of letters are indexed, since numbers and addresses are
+mostly unique and would bloat the index. Query words that aren't indexed
+are still matched, they just don't narrow down the candidates.
+"""
+
+import re
+
+WORD = re.compile(r'\w+', re.UNICODE)
+QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+
+# Longest word we index. Longer ones are most likely keys or digests.
+MAX_WORD_LENGTH = 32
+
+
+def tokenize(message):
+    """
+    Provides the words of a message, lowercased.
+
+    :param str message: message to tokenize.
+
+    :returns: **list** of the message's words, in order
+    """
+
+    return WORD.findall(message.lower())
+
+
+def is_indexed(word):
+    """
+    Checks if a word is one we index.
+
+    :param str word: lowercased word.
+
+    :returns: **True** if the word is indexed, **False** otherwise
+    """
+
+    return 2 <= len(word) <= MAX_WORD_LENGTH and word.isalpha()
+
+
+def index_tokens(event_type, message):
+    """
+    Provides the tokens an entry is indexed under: its indexed words and its
+    event type (prefixed with a colon, so it can't clash with a word).
+
+    :param str event_type: type of the entry.
+    :param str message: message of the entry.
+
+    :returns: **set** of tokens for the entry
+    """
+
+    tokens = set(word for word in tokenize(message) if is_indexed(word))
+    tokens.add(':' + event_type)
+    return tokens
+
+
+def parse_query(query):
+    """
+    Splits a query into its terms. For example...
+
+    >>> parse_query('"clock skew" guard')
+    [('clock', 'skew'), ('guard',)]
+
+    :param str query: words and quoted phrases to search for.
+
+    :returns: **list** of **tuples** with the words of each term
+    """
+
+    phrases = []
+
+    for phrase, word in QUERY_TERM.findall(query or ''):
+        words = tuple(tokenize(phrase or word))
+        if words:
+            phrases.append(words)
+
+    return phrases
+
+
+def query_words(phrases):
+    """
+    Provides the indexed words of a parsed query.
+
+    :param list phrases: terms of the query, as provided by
+      :func:`~erebus.server.handlers.search.parse_query`.
+
+    :returns: **set** of indexed words in the query
+    """
+
+    return set(word for phrase in phrases for word in phrase
+               if is_indexed(word))
+
+
+def matches(phrases, message):
+    """
+    Checks if a message has all of a query's terms.
+
+    :param list phrases: terms of the query, as provided by
+      :func:`~erebus.server.handlers.search.parse_query`.
+    :param str message: message to check.
+
+    :returns: **True** if the message matches, **False** otherwise
+    """
+
+    if not phrases:
+        return True
+
+    # Most messages of candidate blocks don't match, and a substring check
+    # rules them out far quicker than tokenizing.
+
+    lowered = message.lower()
+    for phrase in phrases:
+        for word in phrase:
+            if word not in lowered:
+                return False
+
+    words = ' %s ' % ' '.join(tokenize(lowered))
+    return all(' %s ' % ' '.join(phrase) in words for phrase in phrases)
+
+
+class LogIndex(object):
+    """
+    Inverted index of archive blocks. Bit *i* of each bitmap stands for the
+    *i*-th block we've indexed that's still in the archive. Blocks are
+    indexed in the order they're written and expire oldest first, so
+    expiring blocks just shifts the bitmaps.
+
+    This isn't thread safe, the archive guards it with its lock.
+    """
+
+    def __init__(self):
+        self._blocks = []
+        self._postings = {}
+
+    def add(self, block, tokens):
+        """
+        Indexes a block.
+
+        :param object block: reference to the block, provided by
+          :func:`~erebus.server.handlers.search.LogIndex.candidates`.
+        :param set tokens: tokens of the block's entries, as provided by
+          :func:`~erebus.server.handlers.search.index_tokens`.
+        """
+
+        bit = 1 << len(self._blocks)
+        self._blocks.append(block)
+
+        for token in tokens:
+            self._postings[token] = self._postings.get(token, 0) | bit
+
+    def expire(self, count):
+        """
+        Removes the oldest blocks from the index.
+
+        :param int count: number of blocks to remove.
+        """
+
+        if count <= 0:
+            return
+
+        del self._blocks[:count]
+        postings = {}
+
+        for token, bitmap in self._postings.items():
+            bitmap >>= count
+            if bitmap:
+                postings[token] = bitmap
+
+        self._postings = postings
+
+    def candidates(self, words, types=None):
+        """
+        Provides the blocks that might have entries matching a query.
+
+        :param set words: indexed words of the query.
+        :param set types: event types to match, or any of them if not
+          provided.
+
+        :returns: **list** of block references having all the words and any
+          of the types, from newest to oldest
+        """
+
+        bitmap = (1 << len(self._blocks)) - 1
+
+        for word in words:
+            bitmap &= self._postings.get(word, 0)
+
+        if types:
+            type_bitmap = 0
+            for event_type in types:
+                type_bitmap |= self._postings.get(':' + event_type, 0)
+            bitmap &= type_bitmap
+
+        blocks = []
+
+        while bitmap:
+            index = bitmap.bit_length() - 1
+            blocks.append(self._blocks[index])
+            bitmap ^= 1 << index
+
+        return blocks
+
+    def stats(self):
+        return {
+            'blocks': len(self._blocks),
+            'tokens': len(self._postings),
+        }
@@ -14,23 +14,119 @@ Websocket-related functions, including the main websockets controller,
 base websocket class and custom websocket classes (such as bandwidth, log).
 """
 
+import collections
+import functools
 import json
+import time
 
 import cyclone.websocket
 import stem.util.log
 import stem.util.enum
 
-from erebus.server.handlers import graph, info, log
+from stem.control import State
+from stem.util import conf
+from twisted.internet import reactor
+
+from erebus.server.handlers import graph, history, info, log
 from erebus.util import msg
+from erebus.util.executor import run_query
+from erebus.util.handoff import EventHandoff
+
+
+def conf_handler(key, value):
+    if key in ('ws.queue.maxMessages', 'ws.queue.maxBytes'):
+        return max(1, value)
+    elif key == 'ws.queue.maxBacklog':
+        return max(0, value)
+    elif key == 'log.batch.window':
+        return max(0, value)
+    elif key == 'log.batch.size':
+        return max(1, value)
+    elif key in ('log.repeat.interval', 'log.summary.interval'):
+        return max(1, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'ws.queue.maxMessages': 1000,
+    'ws.queue.maxBytes': 1048576,
+    'ws.queue.maxBacklog': 30,
+    'ws.queue.policy': {},
+    'log.batch.window': 0,
+    'log.batch.size': 200,
+    'log.repeat.interval': 1000,
+    'log.summary.interval': 5000,
+}, conf_handler)
 
 WebSocketType = stem.util.enum.Enum(
     ('BANDWIDTH', 'bandwidth'), ('STATUS', 'status'), ('LOG', 'log'),
     ('INFO', 'info'),
 )
 
+# What to do when a websocket can't keep up with the frames we send it.
+# DROP_OLDEST discards the oldest queued frames of the channel, KEEP_NEWEST
+# only keeps the latest frame of the channel and DISCONNECT closes the
+# connection once its backlog is older than `ws.queue.maxBacklog` seconds.
+QueuePolicy = stem.util.enum.Enum(
+    ('DROP_OLDEST', 'drop_oldest'), ('KEEP_NEWEST', 'keep_newest'),
+    ('DISCONNECT', 'disconnect'),
+)
+
+# Policies used for channels not listed under `ws.queue.policy`.
+DEFAULT_QUEUE_POLICIES = {
+    WebSocketType.BANDWIDTH: QueuePolicy.KEEP_NEWEST,
+    WebSocketType.LOG: QueuePolicy.DROP_OLDEST,
+    WebSocketType.INFO: QueuePolicy.DISCONNECT,
+    WebSocketType.STATUS: QueuePolicy.DISCONNECT,
+}
+
 WEBSOCKETS = None
 
 
+class Frame(object):
+    """
+    Immutable JSON payload shared by every websocket it's sent to. The data
+    is encoded once when the frame is built, so broadcasting it to any
+    number of listeners costs a single encoding.
+
+    :var str payload: JSON encoded data, ready to be sent.
+    """
+
+    __slots__ = ('_payload', '_tagged')
+
+    def __init__(self, data):
+        self._payload = json.dumps(data)
+        self._tagged = {}
+
+    @property
+    def payload(self):
+        return self._payload
+
+    def tagged(self, channel):
+        """
+        Provides this frame with a channel tag, as sent through multiplexed
+        websockets. The tag is spliced into the already encoded payload, so
+        the data isn't encoded again.
+
+        :param str channel: channel the frame belongs to.
+
+        :returns: :class:`~erebus.server.websockets.Frame` with the data
+          and a 'channel' attribute.
+        """
+
+        frame = self._tagged.get(channel)
+        if frame is None:
+            tag = '{"channel": %s' % json.dumps(channel)
+            body = self._payload[1:].lstrip()
+            frame = Frame.__new__(Frame)
+            frame._payload = tag + (body if body == '}' else ', ' + body)
+            frame._tagged = {}
+            self._tagged[channel] = frame
+        return frame
+
+    def __len__(self):
+        return len(self._payload)
+
+
 def ws_controller():
     """
     Provides the WEBSOCKETS singleton.
@@ -65,6 +161,37 @@ class WebSocketController:
 
         self._websockets = dict([(ws_type, []) for ws_type in WebSocketType])
 
+        # Tor and erebus events are delivered by other threads, and handed
+        # to the reactor through this.
+        self._events = EventHandoff()
+
+        # Log entries waiting to be sent as a single LOG-BATCH message, when
+        # batching is enabled (see _send_log_entry()).
+        self._log_batch = []
+        self._log_batch_call = None
+
+        # Pending LOG-REPEAT and LOG-SUMMARY messages (see
+        # _send_log_repeats() and _send_log_summary()).
+        self._log_repeat_call = None
+        self._log_summary_call = None
+
+        # Pending refresh of the values of our BW-EVENT messages (see
+        # _bw_event()).
+        self._bw_refresh = None
+
+        # Encoded RELAY-STATUS message, rebuilt when our consensus entry or
+        # descriptor changes (see relay_status_event()), and the query
+        # rebuilding it. Requests made while it runs wait on it.
+        self._relay_status = None
+        self._relay_status_query = None
+
+        # Broadcast counters, see stats().
+        self._stats = {
+            'frames_encoded': 0,
+            'frames_sent': 0,
+            'encodings_saved': 0,
+        }
+
     def add_websocket(self, ws_type, ws):
         """
         Adds a websocket object to the list of active websockets of a
@@ -112,19 +239,60 @@ class WebSocketController:
     def send_data(self, ws_type, data):
         """
         Send JSON encoded data to a list of websockets of a certain type.
+        The data is encoded only once, and the same frame is handed to
+        every listener.
 
         :param str ws_type: string indicating type of websocket.
-        :param dict data: data to be encoded in JSON.
+        :param dict data: data to be encoded in JSON, or an already
+          encoded :class:`~erebus.server.websockets.Frame`.
         """
 
         ws_listeners = self.get_websockets(ws_type)
-        if ws_listeners is not None:
-            for ws in ws_listeners:
-                try:
-                    ws.sendMessage(json.dumps(data))
-                except cyclone.websocket.FrameDecodeError as exc:
-                    stem.util.log.error(
-                        msg('ws.send_error', type=ws_type, error=exc))
+        if not ws_listeners:
+            return
+
+        if isinstance(data, Frame):
+            frame = data
+        else:
+            frame = Frame(data)
+            self._stats['frames_encoded'] += 1
+
+        # Copy the listeners, since a failed send might drop the websocket
+        # from our list while we are iterating it.
+        ws_listeners = list(ws_listeners)
+        for ws in ws_listeners:
+            try:
+                ws.send_frame(ws_type, frame)
+            except cyclone.websocket.FrameDecodeError as exc:
+                stem.util.log.error(
+                    msg('ws.send_error', type=ws_type, error=exc))
+
+        self._stats['frames_sent'] += len(ws_listeners)
+        self._stats['encodings_saved'] += len(ws_listeners) - 1
+
+    def stats(self):
+        """
+        Provides broadcast counters, including how many JSON encodings were
+        saved by sharing a single frame between listeners.
+
+        :returns: **dict** with websocket statistics.
+        """
+
+        output = dict(self._stats)
+        output['events'] = self._events.stats()
+        output['websockets'] = dict(
+            [(ws_type, len(ws)) for ws_type, ws in self._websockets.items()])
+        # Multiplexed websockets are listed once per subscribed channel.
+        sockets = []
+        for listeners in self._websockets.values():
+            for ws in listeners:
+                if ws not in sockets:
+                    sockets.append(ws)
+
+        output['queues'] = [dict(
+            ws.queue_stats(), type=ws.ws_type(), peer=ws.request.remote_ip)
+            for ws in sockets]
+        return output
 
     def receive_message(self, message, ws):
         """
@@ -143,43 +311,251 @@ class WebSocketController:
         # TODO: check for proper format of message
         # Currently we are assuming the message its valid
 
-        if ws.ws_type() == WebSocketType.BANDWIDTH:
+        if ws.multiplexed:
+            # Multiplexed websockets tag each request with its channel.
+            ws_type = message.get('channel')
+            if ws_type not in WebSocketType:
+                stem.util.log.notice(msg('ws.unknown_channel', type=ws_type))
+                return
+
+            if message['request'] == 'SUBSCRIBE':
+                ws.subscribe(ws_type)
+                return
+            elif message['request'] == 'UNSUBSCRIBE':
+                ws.unsubscribe(ws_type)
+                return
+        else:
+            ws_type = ws.ws_type()
+
+        if ws_type == WebSocketType.BANDWIDTH:
             # Bandwidth cache was requested
             if message['request'] == 'BW-CACHE':
                 bw = graph.bw_handler()
                 if bw is not None:
-                    self.send_data(ws.ws_type(), bw.get_cache())
-
-        elif ws.ws_type() == WebSocketType.INFO:
+                    self._reply(ws, ws_type, 'BW-CACHE', bw.get_cache)
+            # Downsampled bandwidth history was requested
+            elif message['request'] == 'BW-RANGE':
+                try:
+                    bw_range = history.get_range(
+                        int(message['from']),
+                        int(message.get('to') or time.time()),
+                        int(message.get('points') or 0))
+                except (KeyError, TypeError, ValueError) as exc:
+                    stem.util.log.notice(msg(
+                        'ws.bad_request', request='BW-RANGE', error=exc))
+                else:
+                    self.send_to(ws, ws_type, bw_range)
+
+        elif ws_type == WebSocketType.INFO:
             # Relay info was requested. This is info must be delivered upon
             # a request is received by the client, since it's not like BW
             # or LOG events which are sent by tor events.
             if message['request'] == 'INFO':
-                self.send_data(ws.ws_type(), info.get_info())
+                self._reply(ws, ws_type, 'INFO', info.get_info)
+            # Relay status was requested, it's sent from our cache
+            elif message['request'] == 'RELAY-STATUS':
+                if self._relay_status is not None:
+                    self.send_to(ws, ws_type, self._relay_status)
+                else:
+                    d = self._relay_status_query
+
+                    if d is None:
+                        d = self._query_relay_status()
+
+                    d.addCallback(self._send_relay_status, ws, ws_type)
 
-        elif ws.ws_type() == WebSocketType.LOG:
+        elif ws_type == WebSocketType.LOG:
             # Log cache was requested
             if message['request'] == 'LOG-CACHE':
                 logger = log.log_handler()
                 if logger is not None:
-                    self.send_data(ws.ws_type(), logger.get_cache())
+                    self.send_to(ws, ws_type, logger.get_cache())
+            # A page of older log entries was requested
+            elif message['request'] == 'LOG-PAGE':
+                logger = log.log_handler()
+                try:
+                    cursor = message.get('cursor')
+                    log.parse_cursor(cursor)
+                    size = int(message.get('size') or 0)
+                    types = list(message.get('types') or [])
+                except (TypeError, ValueError) as exc:
+                    stem.util.log.notice(msg(
+                        'ws.bad_request', request='LOG-PAGE', error=exc))
+                else:
+                    # Older pages come from the archive, which is on disk.
+                    if logger is not None:
+                        self._reply(ws, ws_type, 'LOG-PAGE', functools.partial(
+                            logger.get_page, cursor, size, types))
+            # Log history was searched
+            elif message['request'] == 'LOG-SEARCH':
+                try:
+                    start, end = message.get('from'), message.get('to')
+                    search = functools.partial(
+                        log.search_logs, message.get('query', ''),
+                        int(start) if start is not None else None,
+                        int(end) if end is not None else None,
+                        list(message.get('types') or []),
+                        int(message.get('limit') or 0))
+                except (TypeError, ValueError) as exc:
+                    stem.util.log.notice(msg(
+                        'ws.bad_request', request='LOG-SEARCH', error=exc))
+                else:
+                    self._reply(ws, ws_type, 'LOG-SEARCH', search)
             # A log filter was sent
             if message['request'] == 'LOG-FILTER':
                 logger = log.log_handler()
                 if logger is not None:
                     log.update_filter()
 
+    def _reply(self, ws, ws_type, request, query):
+        """
+        Replies to a request whose data needs querying tor. The query runs
+        in the query executor, so the reactor doesn't block on tor.
+
+        :param Class ws: :class:`~erebus.server.websockets.BaseWSHandler`
+          which made the request.
+        :param str ws_type: channel of the request.
+        :param str request: name of the request.
+        :param func query: function providing the data to reply with.
+        """
+
+        d = run_query(query)
+        d.addCallback(lambda data: self.send_to(ws, ws_type, data))
+        d.addErrback(self._query_failed, request)
+
+    def _query_failed(self, failure, request):
+        stem.util.log.warn(msg(
+            'ws.query_failed', request=request,
+            error=failure.getErrorMessage()))
+
+    def send_to(self, ws, ws_type, data):
+        """
+        Send JSON encoded data to a single websocket, as a reply to one of
+        its requests.
+
+        :param Class ws: :class:`~erebus.server.websockets.BaseWSHandler`
+          to send the data to.
+        :param str ws_type: channel the data belongs to.
+        :param dict data: data to be encoded in JSON, or an already
+          encoded :class:`~erebus.server.websockets.Frame`.
+        """
+
+        if not isinstance(data, Frame):
+            data = Frame(data)
+            self._stats['frames_encoded'] += 1
+
+        self._stats['frames_sent'] += 1
+        ws.send_frame(ws_type, data)
+
     def bw_event(self, event):
         """
         Handler for BW event, to be attached as a listener to tor controller.
         Whenever an event is received, get BW info and send it through
-        BW websocket.
+        BW websocket. The event is handed to the reactor, so stem's event
+        thread never waits on us.
+
+        :param Class event: :class:`~stem.response.events.Event` delivered
+          by stem.
+        """
+        self._events.put(event.type, self._bw_event, event)
+
+    def _bw_event(self, event):
+        bw_history = history.bw_history()
+        if bw_history is not None:
+            bw_history.add(event.arrived_at, event.read, event.written)
+
+        bw = graph.bw_handler()
+        if bw is not None:
+            # Messages are built here so they're sent in the order of their
+            # events. Only the values they lack are queried, one refresh at
+            # a time.
+            self.send_data(WebSocketType.BANDWIDTH, bw.get_info(event))
+
+            if self._bw_refresh is None and bw.needs_refresh():
+                self._bw_refresh = run_query(bw.refresh)
+                self._bw_refresh.addErrback(self._query_failed, 'BW-EVENT')
+                self._bw_refresh.addBoth(self._bw_refreshed)
+
+    def _bw_refreshed(self, ignored):
+        self._bw_refresh = None
+
+    def relay_status_event(self, event):
+        """
+        Handler for NEWCONSENSUS and NEWDESC events, to be attached as a
+        listener to tor controller. Our relay status is rebuilt if the
+        event is about us, and sent to every INFO websocket.
 
         :param Class event: :class:`~stem.response.events.Event` delivered
           by stem.
         """
-        bw_stats = graph.bw_handler().get_info(event)
-        self.send_data(WebSocketType.BANDWIDTH, bw_stats)
+        self._events.put(event.type, self._relay_status_event, event)
+
+    def _relay_status_event(self, event):
+        d = run_query(info.affects_relay_status, event)
+        d.addCallback(self._relay_status_affected)
+        d.addErrback(self._query_failed, 'RELAY-STATUS')
+
+    def _relay_status_affected(self, affected):
+        if affected:
+            self._update_relay_status()
+
+    def _update_relay_status(self):
+        """
+        Rebuilds our cached RELAY-STATUS message and sends it to every INFO
+        websocket. A query that's already running might have been made
+        before the change, so a new one is made regardless.
+        """
+
+        d = self._query_relay_status()
+        d.addCallback(self._broadcast_relay_status)
+
+    def _query_relay_status(self):
+        """
+        Queries tor for our relay status, which is cached once it's
+        available.
+
+        :returns: :class:`~twisted.internet.defer.Deferred` that fires with
+          the encoded RELAY-STATUS message, or **None** if it's unavailable.
+          Callbacks added to it must provide the message they're given.
+        """
+
+        d = self._relay_status_query = run_query(info.get_relay_status)
+        d.addCallback(self._set_relay_status, d)
+        d.addErrback(self._query_failed, 'RELAY-STATUS')
+        d.addBoth(self._relay_status_queried, d)
+
+        return d
+
+    def _set_relay_status(self, data, d):
+        if data is None:
+            return
+
+        frame = Frame(data)
+        self._stats['frames_encoded'] += 1
+
+        # Queries replaced by a newer one might be out of date.
+        if self._relay_status_query is d:
+            self._relay_status = frame
+
+        return frame
+
+    def _relay_status_queried(self, frame, d):
+        if self._relay_status_query is d:
+            self._relay_status_query = None
+
+        return frame
+
+    def _send_relay_status(self, frame, ws, ws_type):
+        if frame is not None:
+            self.send_to(ws, ws_type, frame)
+
+        return frame
+
+    def _broadcast_relay_status(self, frame):
+        if frame is not None:
+            self.send_data(WebSocketType.INFO, frame)
+
+        return frame
 
     def listen_erebus_log(self, logged_events):
         """
@@ -199,29 +575,143 @@ class WebSocketController:
         calling listen_erebus_log.
         """
         logger = log.log_handler()
-        logger.init_tor_log(self._tor_event)
+        logger.init_tor_log(self._tor_event, self._tor_file_entry)
 
     def _erebus_event(self, record):
         """
-        Handler for listening to single erebus events.
+        Handler for listening to single erebus events. They can be logged
+        by any thread, so they're handed to the reactor.
 
         :param record: log entry formatted by `~stem.util.log`
         """
+        self._events.put('EREBUS', self._handle_erebus_event, record)
+
+    def _handle_erebus_event(self, record):
         logger = log.log_handler()
         entry = logger._erebus_event(record)
         if entry is not None:
-            self.send_data(WebSocketType.LOG, entry)
+            self._send_log_entry(entry)
+        else:
+            self._schedule_log_updates(logger)
 
     def _tor_event(self, record):
         """
-        Handler for listening to single tor events.
+        Handler for listening to single tor events. They're delivered by
+        stem's event thread, so they're handed to the reactor.
 
         :param Class record: a valid :class:`~stem.response.` subclass.
         """
+        self._events.put(record.type, self._handle_tor_event, record)
+
+    def _handle_tor_event(self, record):
         logger = log.log_handler()
         entry = logger._tor_event(record)
         if entry is not None:
+            self._send_log_entry(entry)
+        else:
+            self._schedule_log_updates(logger)
+
+    def _tor_file_entry(self, entry):
+        """
+        Handler for entries read from tor's log file. These are already
+        delivered on the reactor thread.
+
+        :param Class entry: :class:`~erebus.server.handlers.log.LogEntry`
+        """
+        logger = log.log_handler()
+        data = logger._tor_file_event(entry)
+        if data is not None:
+            self._send_log_entry(data)
+        else:
+            self._schedule_log_updates(logger)
+
+    def _send_log_entry(self, entry):
+        """
+        Sends a log entry through LOG websockets. If `log.batch.window` is
+        set, entries are gathered for that many milliseconds (or until
+        `log.batch.size` entries are pending) and then sent together as a
+        single LOG-BATCH message.
+
+        :param dict entry: log entry, as provided by the log handler.
+        """
+
+        if not CONFIG['log.batch.window']:
             self.send_data(WebSocketType.LOG, entry)
+            return
+
+        del entry['header']
+        self._log_batch.append(entry)
+
+        if len(self._log_batch) >= CONFIG['log.batch.size']:
+            self._flush_log_batch()
+        elif self._log_batch_call is None:
+            self._log_batch_call = reactor.callLater(
+                CONFIG['log.batch.window'] / 1000.0, self._flush_log_batch)
+
+    def _flush_log_batch(self):
+        """
+        Sends all pending log entries as a single LOG-BATCH message.
+        """
+
+        if self._log_batch_call is not None:
+            if self._log_batch_call.active():
+                self._log_batch_call.cancel()
+            self._log_batch_call = None
+
+        entries, self._log_batch = self._log_batch, []
+
+        if entries:
+            self.send_data(WebSocketType.LOG, {
+                'header': 'LOG-BATCH',
+                'entries': entries,
+            })
+
+    def _schedule_log_updates(self, logger):
+        """
+        Schedules sending the log entries repeated in the meantime, and a
+        summary of events over their budget. However often entries repeat or
+        events go over budget, clients only get an update every
+        `log.repeat.interval` and `log.summary.interval` milliseconds.
+
+        :param Class logger: :class:`~erebus.server.handlers.log.LogHandler`
+        """
+
+        if self._log_repeat_call is None and logger.has_repeats():
+            self._log_repeat_call = reactor.callLater(
+                CONFIG['log.repeat.interval'] / 1000.0,
+                self._send_log_repeats)
+
+        if self._log_summary_call is None and logger.has_summaries():
+            self._log_summary_call = reactor.callLater(
+                CONFIG['log.summary.interval'] / 1000.0,
+                self._send_log_summary)
+
+    def _send_log_repeats(self):
+        """
+        Sends the log entries repeated since we last did as a LOG-REPEAT
+        message, with the number of times each has been seen.
+        """
+
+        self._log_repeat_call = None
+
+        # Repeated entries might still be waiting in our batch.
+        self._flush_log_batch()
+
+        logger = log.log_handler()
+        if logger is not None and logger.has_repeats():
+            self.send_data(WebSocketType.LOG, logger.get_repeats())
+
+    def _send_log_summary(self):
+        """
+        Sends a LOG-SUMMARY message with the events over their budget since
+        we last did.
+        """
+
+        self._log_summary_call = None
+
+        logger = log.log_handler()
+        if logger is not None and logger.has_summaries():
+            self.send_data(WebSocketType.LOG, logger.get_summary())
 
     def reset_listener(self, controller, state, timestamp):
         """
@@ -234,6 +724,12 @@ class WebSocketController:
           states that a controller can have.
         :param float timestamp: Unix timestamp.
         """
+        self._events.put('STATUS', self._handle_status, state)
+
+    def _handle_status(self, state):
+        if state == State.CLOSED:
+            self._relay_status = None
+
         current_status = info.get_status(state)
         self.send_data(WebSocketType.INFO, current_status)
 
@@ -242,15 +738,195 @@ class WebSocketController:
         Handler to be called when a tor control connection is made and
         it's necessary to send relay info to the client.
         """
-        relay_info = info.get_info()
-        self.send_data(WebSocketType.INFO, relay_info)
+        d = run_query(info.get_info)
+        d.addCallback(lambda data: self.send_data(WebSocketType.INFO, data))
+        d.addErrback(self._query_failed, 'INFO')
+
+        self._update_relay_status()
+
+
+def queue_policy(ws_type):
+    """
+    Provides the slow consumer policy of a websocket type.
+
+    :param str ws_type: string indicating type of websocket.
+
+    :returns: :data:`~erebus.server.websockets.QueuePolicy` of the type.
+    """
+
+    policy = CONFIG['ws.queue.policy'].get(ws_type)
+    if policy not in QueuePolicy:
+        policy = DEFAULT_QUEUE_POLICIES.get(ws_type, QueuePolicy.DROP_OLDEST)
+    return policy
+
+
+class SendQueue(object):
+    """
+    Bounded outbound queue of a single websocket. Frames are written
+    straight to the transport while it keeps up, and are queued once
+    twisted pauses us because its write buffer is full. The queue is
+    capped to `ws.queue.maxMessages` frames and `ws.queue.maxBytes` bytes,
+    and overflows are handled according to the policy of each channel.
+
+    This implements twisted's IPushProducer interface, so it's registered
+    as the producer of the websocket transport.
+    """
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._items = collections.deque()
+        self._bytes = 0
+        self._paused = False
+        self._closed = False
+
+        # Number of queued frames which can't be dropped.
+        self._pinned = 0
+        # Time since our queue has been unable to drain, and the call
+        # checking it's drained `ws.queue.maxBacklog` seconds later (no
+        # further frames might be put to notice it's stalled).
+        self._backlog_since = None
+        self._backlog_call = None
+
+        self._sent = 0
+        self._dropped = collections.Counter()
+
+    def put(self, ws_type, frame):
+        """
+        Sends a frame, or queues it if the transport is paused.
+
+        :param str ws_type: channel the frame belongs to.
+        :param Class frame: :class:`~erebus.server.websockets.Frame`
+        """
+
+        if self._closed:
+            return
+        elif not self._paused and not self._items:
+            self._write(frame)
+            return
+
+        policy = queue_policy(ws_type)
+
+        if policy == QueuePolicy.KEEP_NEWEST:
+            # There's at most one previous frame of this channel.
+            self._drop_oldest(policy, ws_type)
+
+        self._items.append((ws_type, frame, policy))
+        self._bytes += len(frame)
+        if policy == QueuePolicy.DISCONNECT:
+            self._pinned += 1
+
+        while len(self._items) > CONFIG['ws.queue.maxMessages'] or \
+                self._bytes > CONFIG['ws.queue.maxBytes']:
+            if not self._drop_oldest(QueuePolicy.DROP_OLDEST) and \
+                    not self._drop_oldest(QueuePolicy.KEEP_NEWEST):
+                self._disconnect(msg('ws.queue_full', type=ws_type))
+                return
+
+        if self._pinned and self._backlog_since is not None and \
+                time.time() - self._backlog_since > \
+                CONFIG['ws.queue.maxBacklog']:
+            self._disconnect(msg('ws.queue_stalled', type=ws_type,
+                                 seconds=CONFIG['ws.queue.maxBacklog']))
+
+    def stats(self):
+        """
+        Provides queue depth and drop counters.
+
+        :returns: **dict** with the queue statistics.
+        """
+
+        return {
+            'depth': len(self._items),
+            'bytes': self._bytes,
+            'paused': self._paused,
+            'sent': self._sent,
+            'dropped': dict(self._dropped),
+        }
+
+    def pauseProducing(self):
+        self._paused = True
+        if self._backlog_since is None:
+            self._backlog_since = time.time()
+            self._backlog_call = reactor.callLater(
+                CONFIG['ws.queue.maxBacklog'], self._backlog_expired)
+
+    def resumeProducing(self):
+        self._paused = False
+        while self._items and not self._paused and not self._closed:
+            ws_type, frame, policy = self._items.popleft()
+            self._bytes -= len(frame)
+            if policy == QueuePolicy.DISCONNECT:
+                self._pinned -= 1
+            self._write(frame)
+
+        if not self._items:
+            self._backlog_since = None
+            self._cancel_backlog_call()
+
+    def stopProducing(self):
+        self._closed = True
+        self._items.clear()
+        self._bytes, self._pinned = 0, 0
+        self._cancel_backlog_call()
+
+    def _backlog_expired(self):
+        self._backlog_call = None
+
+        for ws_type, frame, policy in self._items:
+            if policy == QueuePolicy.DISCONNECT:
+                self._disconnect(msg('ws.queue_stalled', type=ws_type,
+                                     seconds=CONFIG['ws.queue.maxBacklog']))
+                return
+
+    def _cancel_backlog_call(self):
+        if self._backlog_call is not None:
+            if self._backlog_call.active():
+                self._backlog_call.cancel()
+            self._backlog_call = None
+
+    def _write(self, frame):
+        self._ws.sendMessage(frame.payload)
+        self._sent += 1
+
+    def _drop_oldest(self, policy, ws_type=None):
+        """
+        Drops the oldest queued frame with the given policy.
+
+        :param str policy: policy of the frame to be dropped.
+        :param str ws_type: only drop frames of this channel, if set.
+
+        :returns: **True** if a frame was dropped, **False** otherwise.
+        """
+
+        for index, item in enumerate(self._items):
+            if item[2] == policy and ws_type in (None, item[0]):
+                del self._items[index]
+                self._bytes -= len(item[1])
+                self._dropped[item[0]] += 1
+                return True
+        return False
+
+    def _disconnect(self, reason):
+        stem.util.log.notice(msg(
+            'ws.slow_consumer', peer=self._ws.request.remote_ip,
+            reason=reason))
+        for ws_type, frame, policy in self._items:
+            self._dropped[ws_type] += 1
+        self.stopProducing()
+        # Losing the connection would wait for the write buffer to drain,
+        # which a stalled client never does.
+        self._ws.transport.abortConnection()
 
 
 class BaseWSHandler(cyclone.websocket.WebSocketHandler):
     """
     Base class to be implemented by custom websockets.
+
+    :var bool multiplexed: whether this websocket carries several channels.
     """
 
+    multiplexed = False
+
     def getType(self):
         """
         Each subclass must define its type.
@@ -267,9 +943,17 @@ class BaseWSHandler(cyclone.websocket.WebSocketHandler):
         websocket controller.
         """
 
+        self._send_queue = SendQueue(self)
+        try:
+            # Let twisted pause us when its write buffer is full.
+            self.transport.registerProducer(self._send_queue, True)
+        except RuntimeError as exc:
+            stem.util.log.info(msg('ws.no_flow_control', error=exc))
+
         ws = ws_controller()
         if ws is not None:
-            ws.add_websocket(self.ws_type(), self)
+            for channel in self.channels():
+                ws.add_websocket(channel, self)
             stem.util.log.debug(msg('ws.opened', type=self.ws_type()))
 
     def connectionLost(self, reason):
@@ -281,10 +965,39 @@ class BaseWSHandler(cyclone.websocket.WebSocketHandler):
 
         ws = ws_controller()
         if ws is not None:
-            ws.remove_websocket(self.ws_type(), self)
+            for channel in self.channels():
+                ws.remove_websocket(channel, self)
             stem.util.log.debug(
                 msg('ws.opened', type=self.ws_type(), reason=reason))
 
+    def channels(self):
+        """
+        Provides the channels this websocket is listening to.
+
+        :returns: **list** of websocket types.
+        """
+
+        return [self.ws_type()]
+
+    def send_frame(self, ws_type, frame):
+        """
+        Sends a frame through this websocket's outbound queue.
+
+        :param str ws_type: channel the frame belongs to.
+        :param Class frame: :class:`~erebus.server.websockets.Frame`
+        """
+
+        self._send_queue.put(ws_type, frame)
+
+    def queue_stats(self):
+        """
+        Provides the statistics of this websocket's outbound queue.
+
+        :returns: **dict** with the queue statistics.
+        """
+
+        return self._send_queue.stats()
+
     def messageReceived(self, message):
         """
         Gets called when a message is received from the client.
@@ -333,3 +1046,50 @@ class InfoWSHandler(BaseWSHandler):
 
     def ws_type(self):
         return WebSocketType.INFO
+
+
+class StreamWSHandler(BaseWSHandler):
+    """
+    Multiplexed websocket subclass. It carries any of the websocket types
+    over a single connection: clients subscribe to each channel with a
+    SUBSCRIBE request, and every message is tagged with its channel.
+    """
+
+    multiplexed = True
+
+    def __init__(self, *args, **kwargs):
+        BaseWSHandler.__init__(self, *args, **kwargs)
+        self._channels = set()
+
+    def ws_type(self):
+        return 'stream'
+
+    def channels(self):
+        return list(self._channels)
+
+    def subscribe(self, ws_type):
+        """
+        Starts listening to a channel.
+
+        :param str ws_type: channel to subscribe to.
+        """
+
+        ws = ws_controller()
+        if ws is not None:
+            self._channels.add(ws_type)
+            ws.add_websocket(ws_type, self)
+
+    def unsubscribe(self, ws_type):
+        """
+        Stops listening to a channel.
+
+        :param str ws_type: channel to unsubscribe from.
+        """
+
+        ws = ws_controller()
+        if ws is not None:
+            self._channels.discard(ws_type)
+            ws.remove_websocket(ws_type, self)
+
+    def send_frame(self, ws_type, frame):
+        BaseWSHandler.send_frame(self, ws_type, frame.tagged(ws_type))
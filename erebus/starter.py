@@ -28,7 +28,8 @@ from twisted.internet import reactor, ssl
 from stem.util import conf, log
 
 from erebus.server import websockets
-from erebus.util import arguments, controller
+from erebus.server.handlers import archive, history
+from erebus.util import arguments, controller, executor
 from erebus.util import uses_settings, dual_mode, set_dual_mode, msg
 
 # Default arguments are intended for a local tor instance
@@ -89,7 +90,15 @@ def main(config):
     server_address = args.server_address
 
     if run_server:
+        executor.init_query_executor()
         ws_controller = websockets.init_websockets()
+        history.init_bw_history()
+        reactor.addSystemEventTrigger(
+            'before', 'shutdown', history.bw_history().close)
+        archive.init_log_archive()
+        if archive.log_archive() is not None:
+            reactor.addSystemEventTrigger(
+                'before', 'shutdown', archive.log_archive().close)
         ws_controller.listen_erebus_log(
             arguments.expand_events(config.get('startup.events')))
         # Try to connect to tor instance. If erebus is unable to connect
@@ -0,0 +1,118 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Cache for the results of tor control port queries.
+"""
+
+import threading
+import time
+
+
+class QueryCache(object):
+    """
+    Thread safe collection of query results. Each result expires after a
+    time-to-live, and can be invalidated earlier (usually when a tor event
+    tells us it changed).
+    """
+
+    def __init__(self, ttl):
+        """
+        :param int ttl: seconds a result is kept before querying tor again.
+        """
+
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.RLock()
+
+        # Bumped whenever results are invalidated, so a result fetched
+        # meanwhile isn't cached.
+        self._generation = 0
+
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, fetch):
+        """
+        Provides a cached result, calling fetch to get it if the result is
+        missing or expired.
+
+        :param str key: identifier of the result.
+        :param func fetch: function that queries tor for the result.
+
+        :returns: the cached or freshly fetched result.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+
+        # Query tor without holding our lock.
+        value = fetch()
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.time() + self._ttl, value)
+        return value
+
+    def cached(self, key, default=None):
+        """
+        Provides a cached result without querying tor.
+
+        :param str key: identifier of the result.
+        :param object default: value provided if the result is missing or
+          expired.
+
+        :returns: the cached result, or the default if we don't have it.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+            return default
+
+    def invalidate(self, *keys):
+        """
+        Drops cached results, so they're queried again on their next use.
+
+        :param list keys: identifiers of the results to drop, or all
+          results if none are given.
+        """
+
+        with self._lock:
+            self._generation += 1
+
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Provides cache hits and misses.
+
+        :returns: **dict** with the cache statistics.
+        """
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'size': len(self._entries),
+            }
@@ -11,28 +11,51 @@
 
 """
 Handler for erebus controller, which is in charge of starting a tor
-control connection if tor is up, or wait and retry periodically to connect
-again.
+control connection if tor is up, or wait and retry to connect again.
+
+Retries back off exponentially (with some jitter) while tor stays down.
+Meanwhile we cheaply probe whether tor's control port or socket accepts
+connections, and watch the socket's directory, so we reconnect as soon as
+tor is back rather than on the next retry.
 """
 
+import os
+import random
+
 import stem
 
-from twisted.internet import task
+from twisted.internet import defer, endpoints, protocol, reactor, task
 
 from stem.control import State, EventType
 from stem.util import conf, log
 
 from erebus.server.handlers.graph import init_bw_handler
+from erebus.server.handlers.info import init_relay_info
 from erebus.server import websockets
-from erebus.util import msg, init_tor_controller, tor_controller, uses_settings
+from erebus.util import msg, init_tor_controller, tor_controller
+
+try:
+    from twisted.internet import inotify
+    from twisted.python import filepath
+except ImportError:
+    # inotify is only available on linux
+    inotify = None
 
 
 def conf_handler(key, value):
     if key == 'conn.loopInterval':
-        return max(15, value)
+        return max(1, value)
+    elif key in ('conn.retry.initial', 'conn.probe.interval'):
+        return max(0.1, value)
+    elif key == 'conn.retry.jitter':
+        return min(1.0, max(0.0, value))
+
 
 CONFIG = conf.config_dict('erebus', {
-    'conn.loopInterval': 10,
+    'conn.loopInterval': 15,
+    'conn.retry.initial': 0.5,
+    'conn.retry.jitter': 0.2,
+    'conn.probe.interval': 0.5,
 }, conf_handler)
 
 EREBUS_CONTROLLER = None
@@ -60,6 +83,28 @@ def init_controller(control_port, control_socket):
     EREBUS_CONTROLLER = Controller(control_port, control_socket)
 
 
+def retry_delay(previous):
+    """
+    Provides how long to wait before our next attempt to connect to tor.
+    Delays start at `conn.retry.initial` seconds and double on each failed
+    attempt, up to `conn.loopInterval` seconds. Each is randomly varied by
+    `conn.retry.jitter`, so several erebus instances don't retry in step.
+
+    :param float previous: delay before our last attempt, or **None** if
+      this is the first one.
+
+    :returns: **tuple** of the form (delay, jittered delay)
+    """
+
+    if previous is None:
+        delay = CONFIG['conn.retry.initial']
+    else:
+        delay = min(CONFIG['conn.loopInterval'], previous * 2)
+
+    jitter = CONFIG['conn.retry.jitter']
+    return delay, delay * random.uniform(1 - jitter, 1 + jitter)
+
+
 class Controller:
     """
     Tracks the state of the connection to tor control.
@@ -67,51 +112,68 @@ class Controller:
 
     def __init__(self, control_port, control_socket):
         """
-        Sets default values and starts a loop task to connect to tor control.
+        Sets default values and tries to connect to tor control.
 
         :var tuple _control_port: tuple of the form (address, port)
         :var str _control_socket: string with path to control socket.
         """
 
-        self._loop_call = None
         self._control_port = control_port
         self._control_socket = control_socket
 
-        self._start_loop_check()
+        # Pending attempt to connect, and the delay it was scheduled with.
+        self._retry_call = None
+        self._retry_delay = None
+
+        # Probing of tor's control port and socket while we're disconnected.
+        self._probe_call = None
+        self._probing = False
+        self._reachable = False
+        self._notifier = None
 
-    @uses_settings
-    def _start_loop_check(self, config):
+        self._schedule_retry(0)
+
+    def _schedule_retry(self, delay):
         """
-        Starts a looping task to periodically check for tor control
-        connection.
+        Schedules an attempt to connect to tor control, and watches for
+        tor becoming reachable in the meantime.
+
+        :param float delay: seconds until the attempt.
         """
 
-        if self._loop_call is None:
-            self._loop_call = task.LoopingCall(self._conn_starter)
-        try:
-            # The loop task repeats itself every `loopInterval` seconds.
-            self._loop_call.start(CONFIG['conn.loopInterval'])
-        except AssertionError as exc:
-            log.warn(msg('setup.already_looping', detail=exc))
+        if self._retry_call is not None and self._retry_call.active():
+            self._retry_call.cancel()
+
+        self._retry_call = reactor.callLater(delay, self._conn_starter)
+        self._start_watching()
 
     def _conn_starter(self):
         """
-        Function to be called from the looping task at _start_loop_check()
-        If a connection is made, then stop the looping task.
+        Tries to connect to tor control. If we're unable to, then schedule
+        our next attempt.
         """
 
+        self._retry_call = None
+
         controller = tor_controller()
         if controller is None or not controller.is_alive():
             self._start_tor_controller()
-            log.notice(msg(
-                'notice.try_to_connect', interval=CONFIG['conn.loopInterval']))
-        else:
-            self._loop_call.stop()
+            controller = tor_controller()
+
+        if controller is not None and controller.is_alive():
+            self._retry_delay = None
+            self._stop_watching()
+            return
+
+        self._retry_delay, delay = retry_delay(self._retry_delay)
+        log.notice(msg('notice.try_to_connect', interval='%0.1f' % delay))
+        self._schedule_retry(delay)
 
     def _conn_listener(self, controller, state, timestamp):
         """
         Function to be called when tor control connection changes its
-        state. If the new state is CLOSED, then try to reconnect.
+        state. If the new state is CLOSED, then try to reconnect. Stem calls
+        this from its own thread, so we're handed to the reactor.
 
         :param Class controller: :class:`~stem.control.BaseController`.
         :param Class state: :class:`~stem.control.State` enumeration for
@@ -120,8 +182,106 @@ class Controller:
         """
 
         if state == State.CLOSED:
-            log.notice(msg('notice.control_conn_closed'))
-            self._start_loop_check()
+            reactor.callFromThread(self._conn_closed)
+
+    def _conn_closed(self):
+        log.notice(msg('notice.control_conn_closed'))
+
+        # Tor is usually restarting, so start over with short delays.
+        self._retry_delay = None
+        self._reachable = False
+        self._schedule_retry(retry_delay(None)[1])
+
+    def _start_watching(self):
+        """
+        Starts probing tor's control port and socket, and watching the
+        directory of its control socket, until we're connected.
+        """
+
+        if self._probe_call is None:
+            self._probe_call = task.LoopingCall(self._probe)
+            self._probe_call.start(CONFIG['conn.probe.interval'], now=False)
+
+        if self._notifier is None and self._control_socket and \
+                inotify is not None:
+            socket_dir = os.path.dirname(self._control_socket) or '.'
+            try:
+                self._notifier = inotify.INotify()
+                self._notifier.startReading()
+                self._notifier.watch(
+                    filepath.FilePath(socket_dir),
+                    mask=inotify.IN_CREATE | inotify.IN_MOVED_TO |
+                    inotify.IN_ATTRIB,
+                    callbacks=[self._notified])
+            except inotify.INotifyError:
+                # Likely the directory doesn't exist (yet), so we rely on
+                # probing.
+                self._stop_notifier()
+
+    def _stop_watching(self):
+        if self._probe_call is not None:
+            if self._probe_call.running:
+                self._probe_call.stop()
+            self._probe_call = None
+
+        self._stop_notifier()
+
+    def _stop_notifier(self):
+        if self._notifier is not None:
+            self._notifier.loseConnection()
+            self._notifier = None
+
+    def _notified(self, ignored, path, mask):
+        if path.basename() == os.path.basename(self._control_socket):
+            self._probe()
+
+    def _probe(self):
+        """
+        Checks if tor's control port or socket accepts connections, just
+        opening and closing one. If tor has become reachable since our last
+        probe we try to connect right away, rather than waiting for our
+        scheduled attempt.
+        """
+
+        if self._probing:
+            return
+
+        probes = []
+        factory = protocol.Factory.forProtocol(protocol.Protocol)
+        timeout = CONFIG['conn.probe.interval']
+
+        if self._control_port:
+            address, port = self._control_port
+            probes.append(endpoints.TCP4ClientEndpoint(
+                reactor, address, port, timeout=timeout).connect(factory))
+
+        if self._control_socket and os.path.exists(self._control_socket):
+            probes.append(endpoints.UNIXClientEndpoint(
+                reactor, self._control_socket,
+                timeout=timeout).connect(factory))
+
+        if not probes:
+            self._reachable = False
+            return
+
+        self._probing = True
+        for d in probes:
+            d.addCallbacks(self._probe_connected, lambda failure: False)
+
+        d = defer.gatherResults(probes)
+        d.addCallback(self._probed)
+
+    def _probe_connected(self, conn):
+        conn.transport.loseConnection()
+        return True
+
+    def _probed(self, results):
+        self._probing = False
+        reachable, self._reachable = self._reachable, any(results)
+
+        if self._reachable and not reachable and self._retry_call is not None:
+            log.info(msg('info.control_reachable'))
+            self._schedule_retry(0)
 
     def _start_tor_controller(self):
         """
@@ -147,6 +307,13 @@ class Controller:
                 # Bandwidth events
                 controller.add_event_listener(
                     ws_controller.bw_event, EventType.BW)
+                # Relay info is cached until tor's configuration changes
+                init_relay_info(controller)
+                # Relay status is rebuilt when our consensus entry or
+                # descriptor changes
+                controller.add_event_listener(
+                    ws_controller.relay_status_event,
+                    EventType.NEWCONSENSUS, EventType.NEWDESC)
                 # Tor control connection state
                 controller.add_status_listener(ws_controller.reset_listener)
                 controller.add_status_listener(self._conn_listener)
@@ -0,0 +1,173 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Executor for tor control port queries. Stem's queries are blocking, so
+they run in a dedicated thread pool and their results are delivered to the
+reactor through Deferreds.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure, threadpool
+
+from stem.util import conf
+
+
+def conf_handler(key, value):
+    if key == 'query.threads':
+        return max(1, value)
+    elif key in ('query.timeout', 'query.maxPending'):
+        return max(0, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'query.threads': 4,
+    'query.timeout': 10,
+    'query.maxPending': 100,
+}, conf_handler)
+
+QUERY_EXECUTOR = None
+
+
+def query_executor():
+    """
+    Provides the QUERY_EXECUTOR singleton.
+
+    :returns: :class:`~erebus.util.executor.QueryExecutor`
+    """
+
+    return QUERY_EXECUTOR
+
+
+def init_query_executor():
+    """
+    Initializes the query executor instance and returns it.
+
+    :returns: :class:`~erebus.util.executor.QueryExecutor`
+    """
+
+    global QUERY_EXECUTOR
+    QUERY_EXECUTOR = QueryExecutor()
+    return QUERY_EXECUTOR
+
+
+def run_query(func, *args, **kwargs):
+    """
+    Runs a blocking function through the query executor. This is a
+    passthrough for :func:`~erebus.util.executor.QueryExecutor.run`.
+
+    :returns: **Deferred** which fires with the function's result.
+    """
+
+    return QUERY_EXECUTOR.run(func, *args, **kwargs)
+
+
+class QueryExecutor(object):
+    """
+    Runs blocking control port queries in a thread pool of `query.threads`
+    threads. At most that many queries run at once, up to
+    `query.maxPending` more wait for a thread, and queries taking longer
+    than `query.timeout` seconds fail with a
+    :class:`~twisted.internet.defer.TimeoutError`. A query that timed out
+    still holds its thread until it returns, so it keeps its slot too.
+    """
+
+    def __init__(self):
+        self._pool = threadpool.ThreadPool(
+            1, CONFIG['query.threads'], 'erebus-query')
+        self._semaphore = defer.DeferredSemaphore(CONFIG['query.threads'])
+
+        self._stats = {
+            'completed': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'rejected': 0,
+        }
+
+        # Queries that timed out, but whose threads are still running.
+        self._abandoned = 0
+
+        reactor.callWhenRunning(self._pool.start)
+        reactor.addSystemEventTrigger('during', 'shutdown', self._pool.stop)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs a blocking function in our thread pool. This should only be
+        called from the reactor thread.
+
+        :param func func: function to be run.
+        :param list args: arguments of the function.
+        :param dict kwargs: keyword arguments of the function.
+
+        :returns: **Deferred** which fires with the function's result, or
+          fails if it raised an exception, timed out or too many queries
+          were pending.
+        """
+
+        if len(self._semaphore.waiting) >= CONFIG['query.maxPending']:
+            self._stats['rejected'] += 1
+            return defer.fail(defer.TimeoutError(
+                'too many pending control port queries'))
+
+        d = self._semaphore.acquire()
+        d.addCallback(lambda ignored: self._run(func, *args, **kwargs))
+        return d
+
+    def _run(self, func, *args, **kwargs):
+        result = defer.Deferred()
+        timeout = CONFIG['query.timeout']
+        timeout_call = reactor.callLater(
+            timeout, self._timed_out, result, func, timeout) if timeout \
+            else None
+
+        def finished(value):
+            # The thread is done, so its slot can be taken by another query.
+            self._semaphore.release()
+
+            if timeout_call is not None and timeout_call.active():
+                timeout_call.cancel()
+
+            if result.called:
+                # We already failed with a timeout.
+                self._abandoned -= 1
+                return None
+
+            if isinstance(value, failure.Failure):
+                self._stats['failed'] += 1
+            else:
+                self._stats['completed'] += 1
+
+            result.callback(value)
+
+        d = threads.deferToThreadPool(
+            reactor, self._pool, func, *args, **kwargs)
+        d.addBoth(finished)
+        return result
+
+    def _timed_out(self, result, func, timeout):
+        self._stats['timeouts'] += 1
+        self._abandoned += 1
+
+        result.errback(defer.TimeoutError('%s took more than %i seconds' % (
+            getattr(func, '__name__', repr(func)), timeout)))
+
+    def stats(self):
+        """
+        Provides counters of the queries we ran.
+
+        :returns: **dict** with the executor statistics.
+        """
+
+        output = dict(self._stats)
+        output['running'] = len(self._pool.working)
+        output['pending'] = len(self._semaphore.waiting)
+        output['abandoned'] = self._abandoned
+        return output
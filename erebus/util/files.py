@@ -0,0 +1,243 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+File reading utilities.
+"""
+
+import os
+
+from twisted.internet import task
+
+try:
+    from twisted.internet import inotify
+    from twisted.python import filepath
+except ImportError:
+    # inotify is only available on linux
+    inotify = None
+
+# Maximum number of bytes read from a followed file at a time.
+READ_SIZE = 1048576
+
+# Number of bytes read at a time when reading a file backward.
+REVERSE_READ_SIZE = 65536
+
+
+def reverse_lines(path):
+    """
+    Provides the lines of a file from last to first, without their line
+    endings. The file is read backward from its end a block at a time, so
+    only the blocks holding the lines we're asked for are read, and the
+    iteration can stop at any point without reading the rest of the file.
+
+    Files being read might be truncated under us (as logrotate's
+    'copytruncate' does), in which case we stop at what we could read.
+
+    :param str path: location of the file to read.
+
+    :returns: **iterator** for the lines of the file, from last to first.
+
+    :raises: **IOError** if unable to read the file
+    """
+
+    with open(path, 'rb') as lines_file:
+        lines_file.seek(0, os.SEEK_END)
+        end = lines_file.tell()
+
+        if end == 0:
+            return
+
+        # Start of the line at the beginning of the last block we read,
+        # which might continue in the block before it.
+        remainder = None
+
+        while end > 0:
+            start = max(0, end - REVERSE_READ_SIZE)
+            lines_file.seek(start)
+            block = lines_file.read(end - start)
+
+            if len(block) < end - start:
+                return  # truncated while we were reading it
+
+            if remainder is None:
+                # A trailing newline doesn't start another line.
+                if block.endswith(b'\n'):
+                    block = block[:-1]
+
+                remainder = b''
+
+            lines = (block + remainder).split(b'\n')
+            remainder = lines.pop(0)
+
+            for line in reversed(lines):
+                yield line.rstrip(b'\r')
+
+            end = start
+
+        yield remainder.rstrip(b'\r')
+
+
+class FileFollower(object):
+    """
+    Follows the content appended to a file, like 'tail -F'. We're notified of
+    changes through inotify when it's available, and otherwise check the
+    file every few seconds.
+
+    Rotation (the path being replaced by a new file) is noticed by the inode
+    changing, after which we finish reading the old file and start at the
+    beginning of the new one. If the file shrinks it was truncated, so we
+    read it again from the start.
+
+    Our listener is called from the reactor thread with lists of complete
+    lines, without their line endings. Incomplete lines are held until the
+    rest of them is written.
+    """
+
+    def __init__(self, path, listener, interval=1.0):
+        """
+        :param str path: location of the file to follow.
+        :param func listener: function to be notified of new lines.
+        :param float interval: seconds between checks when we're polling.
+        """
+
+        self.path = path
+        self._listener = listener
+        self._interval = interval
+
+        self._file = None
+        self._inode = None
+        self._remainder = b''
+
+        self._notifier = None
+        self._loop_call = None
+
+    def start(self):
+        """
+        Starts following the file. Only content written after this is
+        provided to our listener.
+
+        :returns: **bool** that's **True** if we're notified through inotify
+          and **False** if we're polling.
+
+        :raises: **IOError** if unable to read the file
+        """
+
+        self.stop()
+        self._open(from_start=False)
+
+        if inotify is not None:
+            # We watch the directory rather than the file, so we also hear
+            # of a new file taking its place.
+            try:
+                self._notifier = inotify.INotify()
+                self._notifier.startReading()
+                self._notifier.watch(
+                    filepath.FilePath(os.path.dirname(self.path) or '.'),
+                    mask=inotify.IN_MODIFY | inotify.IN_CREATE |
+                    inotify.IN_MOVED_TO | inotify.IN_ATTRIB,
+                    callbacks=[self._notified])
+                return True
+            except inotify.INotifyError:
+                self._stop_notifier()
+
+        self._loop_call = task.LoopingCall(self.check)
+        self._loop_call.start(self._interval, now=False)
+        return False
+
+    def stop(self):
+        """
+        Stops following the file.
+        """
+
+        self._stop_notifier()
+
+        if self._loop_call is not None:
+            if self._loop_call.running:
+                self._loop_call.stop()
+            self._loop_call = None
+
+        self._close()
+
+    def check(self):
+        """
+        Reads anything that's been written since we last checked, handling
+        rotation and truncation of the file.
+        """
+
+        if self._file is None:
+            try:
+                self._open(from_start=True)
+            except IOError:
+                return  # the file hasn't been recreated yet
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None  # rotated, but the new file isn't there yet
+
+        if stat is not None and stat.st_ino != self._inode:
+            # Rotated. Anything left in the old file is the end of it.
+            self._read(final=True)
+            self._close()
+
+            try:
+                self._open(from_start=True)
+            except IOError:
+                return
+        elif stat is not None and stat.st_size < self._file.tell():
+            self._file.seek(0)
+            self._remainder = b''
+
+        self._read()
+
+    def _notified(self, ignored, path, mask):
+        if path.basename() == os.path.basename(self.path):
+            self.check()
+
+    def _open(self, from_start):
+        self._file = open(self.path, 'rb')
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._remainder = b''
+
+        if not from_start:
+            self._file.seek(0, os.SEEK_END)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._remainder = b''
+
+    def _stop_notifier(self):
+        if self._notifier is not None:
+            self._notifier.loseConnection()
+            self._notifier = None
+
+    def _read(self, final=False):
+        # Read in chunks, so a burst of verbose logging is handed to our
+        # listener in pieces.
+
+        while True:
+            content = self._file.read(READ_SIZE)
+
+            if content:
+                lines = (self._remainder + content).split(b'\n')
+                self._remainder = lines.pop()
+
+                if lines:
+                    self._listener([line.rstrip(b'\r') for line in lines])
+
+            if len(content) < READ_SIZE:
+                break
+
+        if final and self._remainder:
+            self._listener([self._remainder.rstrip(b'\r')])
+            self._remainder = b''
@@ -0,0 +1,161 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Handoff of events from other threads (like stem's event thread) to the
+reactor thread, where websockets can be safely written.
+"""
+
+import collections
+
+import stem.util.enum
+
+from twisted.internet import reactor
+from stem.util import conf, log
+
+from erebus.util import msg
+
+
+def conf_handler(key, value):
+    if key in ('events.queue.size', 'events.drain.batch'):
+        return max(1, value)
+
+
+CONFIG = conf.config_dict('erebus', {
+    'events.queue.size': 10000,
+    'events.queue.limit': {},
+    'events.queue.policy': {},
+    'events.drain.batch': 1000,
+}, conf_handler)
+
+# What to do when the queue of an event type is full. DROP_OLDEST discards
+# the oldest queued event, DROP_NEWEST discards the event being queued.
+DropPolicy = stem.util.enum.Enum(
+    ('DROP_OLDEST', 'drop_oldest'), ('DROP_NEWEST', 'drop_newest'),
+)
+
+# Queue sizes used for event types not listed under `events.queue.limit`
+# (others default to `events.queue.size`). Only the latest BW events are
+# worth keeping.
+DEFAULT_QUEUE_LIMITS = {
+    'BW': 30,
+}
+
+
+class EventHandoff(object):
+    """
+    Bounded queues of events waiting to be handled on the reactor thread,
+    one per event type. Producers never block: queuing is a single deque
+    append, and the reactor is woken up with callFromThread only when no
+    drain is already pending. The reactor then handles queued events in
+    batches of `events.drain.batch`.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._scheduled = False
+
+        self._handled = collections.Counter()
+        self._dropped = collections.Counter()
+
+    def _queue(self, event_type):
+        queue = self._queues.get(event_type)
+
+        if queue is None:
+            limit = CONFIG['events.queue.limit'].get(
+                event_type, DEFAULT_QUEUE_LIMITS.get(event_type))
+
+            try:
+                limit = max(1, int(limit))
+            except (TypeError, ValueError):
+                limit = CONFIG['events.queue.size']
+
+            # Only created once, even if two threads race for it.
+            queue = self._queues.setdefault(
+                event_type, collections.deque(maxlen=limit))
+
+        return queue
+
+    def put(self, event_type, handler, *args):
+        """
+        Queues an event to be handled on the reactor thread. This can be
+        called from any thread.
+
+        :param str event_type: type of the event, which picks its queue
+          and drop policy.
+        :param func handler: function to be called with the event.
+        :param list args: arguments for the handler.
+        """
+
+        queue = self._queue(event_type)
+
+        if len(queue) >= queue.maxlen:
+            self._dropped[event_type] += 1
+
+            policy = CONFIG['events.queue.policy'].get(event_type)
+            if policy == DropPolicy.DROP_NEWEST:
+                return
+
+        # Full deques drop their oldest item when appending.
+        queue.append((handler, args))
+
+        if not self._scheduled:
+            self._scheduled = True
+            reactor.callFromThread(self._drain)
+
+    def _drain(self):
+        """
+        Handles a batch of queued events, taking from each event type in
+        turn so a flood of one type can't starve the others.
+        """
+
+        self._scheduled = False
+        budget = CONFIG['events.drain.batch']
+
+        while budget > 0:
+            # Other threads might add queues, so iterate over a copy.
+            pending = [(event_type, queue) for event_type, queue
+                       in list(self._queues.items()) if queue]
+            if not pending:
+                return
+
+            share = max(1, budget // len(pending))
+            for event_type, queue in pending:
+                for _ in range(min(share, len(queue))):
+                    handler, args = queue.popleft()
+                    self._handle(handler, args)
+                    self._handled[event_type] += 1
+                budget -= share
+
+        # Yield to the reactor before handling the rest.
+        if not self._scheduled and any(list(self._queues.values())):
+            self._scheduled = True
+            reactor.callLater(0, self._drain)
+
+    def _handle(self, handler, args):
+        try:
+            handler(*args)
+        except Exception as exc:
+            log.warn(msg('events.handler_failed', error=exc))
+
+    def stats(self):
+        """
+        Provides queue depths, and how many events were handled or dropped.
+
+        :returns: **dict** with the handoff statistics.
+        """
+
+        return {
+            'queued': dict([(event_type, len(queue))
+                            for event_type, queue in self._queues.items()]),
+            'dropped': dict(self._dropped),
+            'handled': dict(self._handled),
+        }
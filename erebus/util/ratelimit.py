@@ -0,0 +1,114 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Rate limiting of events with token buckets, one per event type. Events over
+their type's budget are only counted, so they can be summarized.
+"""
+
+import collections
+import time
+
+
+class RateLimiter(object):
+    """
+    Token buckets for event types. Each type has a rate (events per second)
+    and can burst up to **burst** seconds worth of events. Types without a
+    rate aren't limited.
+    """
+
+    def __init__(self, rates, burst=1.0):
+        """
+        :param dict rates: mapping of event types to their rate.
+        :param float burst: seconds of events each bucket holds.
+        """
+
+        self._rates = {}
+        self._buckets = {}
+
+        for event_type, rate in rates.items():
+            try:
+                rate = float(rate)
+            except (TypeError, ValueError):
+                continue
+
+            if rate > 0:
+                capacity = max(1.0, rate * burst)
+                self._rates[event_type] = (rate, capacity)
+                self._buckets[event_type] = [capacity, time.time()]
+
+        # Keys of the events over budget since the last summary.
+        self._suppressed = {}
+
+    def allow(self, event_type):
+        """
+        Takes a token from the bucket of an event type.
+
+        :param str event_type: type of the event.
+
+        :returns: **True** if the event is within budget, **False** otherwise
+        """
+
+        bucket = self._buckets.get(event_type)
+
+        if bucket is None:
+            return True
+
+        rate, capacity = self._rates[event_type]
+        now = time.time()
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+
+        bucket[0] = tokens
+        return False
+
+    def suppress(self, event_type, key):
+        """
+        Counts an event that was over budget.
+
+        :param str event_type: type of the event.
+        :param str key: what the event is about, for summarizing them.
+        """
+
+        counts = self._suppressed.get(event_type)
+
+        if counts is None:
+            counts = self._suppressed[event_type] = collections.Counter()
+
+        counts[key] += 1
+
+    def has_suppressed(self):
+        """
+        Checks if any events were over budget since our last summary.
+
+        :returns: **True** if events were suppressed, **False** otherwise
+        """
+
+        return bool(self._suppressed)
+
+    def summarize(self, top=5):
+        """
+        Summarizes the events over budget since we last did.
+
+        :param int top: number of most common keys to provide for each type.
+
+        :returns: **list** of (event_type, count, [(key, count)...]) tuples
+        """
+
+        suppressed, self._suppressed = self._suppressed, {}
+
+        return [
+            (event_type, sum(counts.values()), counts.most_common(top))
+            for event_type, counts in sorted(suppressed.items())]
@@ -0,0 +1,229 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Erebus, a web dashboard for tor relays.
+#
+# :copyright:   (c) 2015, The Tor Project, Inc.
+#               (c) 2015, Damian Johnson
+#               (c) 2015, Cristobal Leiva
+#
+# :license: See LICENSE for licensing information.
+
+"""
+Runs erebus' benchmarks. Provide the names of the benchmarks to run, or
+none to run all of them:
+
+  python run_benchmarks.py [event_formatters] [log_timestamps] ...
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import stem.response
+
+from stem.response import events
+
+from erebus.server.handlers import log
+
+# Sample of each tor event type erebus logs.
+SAMPLE_EVENTS = {
+    'DEBUG': '650 DEBUG conn_read_callback(): socket 14 wants to read.',
+    'INFO': '650 INFO circuit_finish_handshake(): Finished building '
+            'circuit hop',
+    'NOTICE': '650 NOTICE Bootstrapped 100%: Done',
+    'WARN': '650 WARN Your system clock just jumped 3600 seconds forward',
+    'ERR': '650 ERR Unable to open configuration file',
+    'ADDRMAP': '650 ADDRMAP www.example.com 192.0.2.1 "2012-11-19 00:50:13" '
+               'EXPIRES="2012-11-19 08:50:13"',
+    'AUTHDIR_NEWDESCS': '650+AUTHDIR_NEWDESCS\r\nAction\r\nMessage\r\n'
+                        'Descriptor\r\n.\r\n650 OK',
+    'BUILDTIMEOUT_SET': '650 BUILDTIMEOUT_SET COMPUTED TOTAL_TIMES=124 '
+                        'TIMEOUT_MS=9019 XM=1375 ALPHA=0.855662 '
+                        'CUTOFF_QUANTILE=0.800000 TIMEOUT_RATE=0.137097 '
+                        'CLOSE_MS=21850 CLOSE_RATE=0.072581',
+    'BW': '650 BW 15 25',
+    'CIRC': '650 CIRC 7 BUILT $999A226EBED397F331B612FE1E4CFAE5C1F201BA=piyaz '
+            'PURPOSE=GENERAL TIME_CREATED=2012-11-08T16:48:38.417238',
+    'CLIENTS_SEEN': '650 CLIENTS_SEEN TimeStarted="2008-12-25 23:50:43" '
+                    'CountrySummary=us=16,de=8,uk=8 IPVersions=v4=16,v6=40',
+    'DESCCHANGED': '650 DESCCHANGED',
+    'GUARD': '650 GUARD ENTRY $36B5DBA788246E8369DBAF58577C6BC044A9A374 UP',
+    'NEWCONSENSUS': '650+NEWCONSENSUS\r\nr Beaver /96bKo4soysolMgKn5Hex2nyFSY '
+                    'pAJH9dSBp/CG6sPhhVY/5bLaVPM 2012-12-02 22:02:45 '
+                    '77.223.43.54 9001 0\r\ns Fast Named Running Stable '
+                    'Valid\r\n.\r\n650 OK',
+    'NEWDESC': '650 NEWDESC $B3FA3110CC6F42443F039220C134CBD2FC4F0493=Sakura',
+    'NS': '650+NS\r\nr whnetz dbBxYcJriTTrcxsuy4PUZcMRwCA '
+          'VStM7KAIH/mXXoGDUpoGB1OXufg 2012-12-02 21:03:56 141.70.120.13 9001 '
+          '9030\r\ns Fast HSDir Named Stable V2Dir Valid\r\n.\r\n650 OK',
+    'ORCONN': '650 ORCONN '
+              '$7ED90E2833EE38A75795BA9237B0A4560E51E1A0=GreenDragon '
+              'CONNECTED',
+    'STREAM': '650 STREAM 18 NEW 0 encrypted.google.com:443 '
+              'SOURCE_ADDR=127.0.0.1:47849 PURPOSE=USER',
+    'STREAM_BW': '650 STREAM_BW 2 15 25',
+    'STATUS_CLIENT': '650 STATUS_CLIENT NOTICE CONSENSUS_ARRIVED',
+    'STATUS_GENERAL': '650 STATUS_GENERAL NOTICE CLOCK_JUMPED TIME=3600',
+    'STATUS_SERVER': '650 STATUS_SERVER NOTICE CHECKING_REACHABILITY '
+                     'ORADDRESS=71.35.143.230:9050',
+}
+
+
+def _timed(label, func, count):
+    start_time = time.time()
+    result = func()
+    runtime = time.time() - start_time
+
+    print('  %-28s %8.3fs  (%.0f/s)' % (label, runtime, count / runtime))
+    return runtime, result
+
+
+def _strptime_timestamp(line_comp, isdst):
+    """
+    Timestamp parsing of read_tor_log prior to TimestampParser, kept as a
+    reference.
+    """
+
+    current_year = str(datetime.datetime.now().year)
+    timestamp_str = current_year + ' ' + ' '.join(line_comp[:3])
+    timestamp_str = timestamp_str.split('.', 1)[0]
+    timestamp_comp = list(time.strptime(timestamp_str, '%Y %b %d %H:%M:%S'))
+    timestamp_comp[8] = isdst
+    timestamp = int(time.mktime(tuple(timestamp_comp)))
+
+    if timestamp > time.time():
+        timestamp_comp[0] -= 1
+        timestamp = int(time.mktime(timestamp_comp))
+
+    return timestamp
+
+
+def bench_log_timestamps(lines=100000):
+    """
+    Parses the timestamps of a tor log with TimestampParser and with the
+    strptime based parsing it replaced.
+    """
+
+    print('log_timestamps: %i lines' % lines)
+
+    # Spread the log through the last 45 days, newest line first like
+    # read_tor_log provides them.
+    now = time.time()
+    step = 45 * 86400.0 / lines
+
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) as log_file:
+        for i in range(lines):
+            entry_time = now - i * step
+            log_file.write('%s.%03i [notice] Heartbeat: uptime is %i\n' % (
+                time.strftime('%b %d %H:%M:%S', time.localtime(entry_time)),
+                random.randint(0, 999), i))
+
+    try:
+        with open(log_file.name) as log_lines:
+            line_comps = [line.split() for line in log_lines]
+    finally:
+        os.remove(log_file.name)
+
+    isdst = time.localtime().tm_isdst
+
+    def parse_strptime():
+        return [_strptime_timestamp(comp, isdst) for comp in line_comps]
+
+    def parse_fast():
+        parser = log.TimestampParser()
+        return [parser.parse(*comp[:3]) for comp in line_comps]
+
+    legacy_time, legacy = _timed('strptime', parse_strptime, lines)
+    fast_time, fast = _timed('TimestampParser', parse_fast, lines)
+
+    mismatches = sum([1 for a, b in zip(legacy, fast) if a != b])
+    print('  speedup: %.1fx, mismatches: %i' % (
+        legacy_time / fast_time, mismatches))
+
+
+def _isinstance_message(event):
+    """
+    Formatting of LogHandler._tor_event prior to EVENT_FORMATTERS, kept as a
+    reference.
+    """
+
+    msg_str = ' '.join(str(event).split(' ')[1:])
+    if isinstance(event, events.BandwidthEvent):
+        msg_str = 'READ: %i, WRITTEN: %i' % (event.read, event.written)
+    elif isinstance(event, events.LogEvent):
+        msg_str = event.message
+
+    return msg_str
+
+
+def _dispatch_message(event):
+    formatter = log.EVENT_FORMATTERS.get(event.type, log.event_content)
+    return formatter(event)
+
+
+def bench_event_formatters(count=100000):
+    """
+    Formats tor events of each type we log with EVENT_FORMATTERS and with the
+    isinstance chain it replaced.
+    """
+
+    print('event_formatters: %i events of each type' % count)
+
+    totals = [0.0, 0.0]
+    mismatches = []
+
+    for event_type in sorted(set(log.TOR_EVENT_TYPES.values())):
+        if event_type not in SAMPLE_EVENTS:
+            print('  %-28s no sample' % event_type)
+            continue
+
+        event = stem.response.ControlMessage.from_str(
+            SAMPLE_EVENTS[event_type] + '\r\n', 'EVENT')
+        sample = [event] * count
+
+        def format_legacy():
+            return [_isinstance_message(e) for e in sample]
+
+        def format_dispatch():
+            return [_dispatch_message(e) for e in sample]
+
+        print('  %s' % event_type)
+        legacy_time, legacy = _timed('isinstance', format_legacy, count)
+        dispatch_time, dispatch = _timed('EVENT_FORMATTERS', format_dispatch,
+                                         count)
+
+        totals[0] += legacy_time
+        totals[1] += dispatch_time
+
+        if legacy[0] != dispatch[0]:
+            mismatches.append(event_type)
+
+    # Multi-line events (NS, NEWCONSENSUS...) differ by design, the
+    # isinstance chain split them on spaces and dropped their first word.
+
+    print('  speedup: %.1fx, differing: %s' % (
+        totals[0] / totals[1], ', '.join(mismatches) or 'none'))
+
+
+BENCHMARKS = {
+    'event_formatters': bench_event_formatters,
+    'log_timestamps': bench_log_timestamps,
+}
+
+
+def main(names):
+    for name in names or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print('Unknown benchmark: %s (options: %s)' % (
+                name, ', '.join(sorted(BENCHMARKS))))
+            sys.exit(1)
+
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -25,6 +25,7 @@ EREBUS_BASE = os.path.dirname(__file__)
 SRC_PATHS = [os.path.join(EREBUS_BASE, path) for path in (
     'erebus',
     'run_tests.py',
+    'run_benchmarks.py',
     'run_erebus.py',
 )]
 